@@ -0,0 +1,32 @@
+import random
+
+
+class AdaptivePoller:
+    # Works out how long to wait before the next poll of a source.
+    #
+    # Right after a poll that saw changes the interval drops back to
+    # min_interval, so a burst of new events is picked up quickly. Every poll
+    # without changes multiplies the interval by backoff_factor, up to
+    # max_interval. When the source throttles us the interval backs off as
+    # well, and a Retry-After from the server is always honoured. Every delay
+    # gets +/- jitter (a fraction) so pollers don't line up, but never drops
+    # below the Retry-After.
+
+    def __init__(self, min_interval, max_interval, backoff_factor=2.0, jitter=0.1):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+        self.interval = min_interval
+
+    def next_delay(self, changes=0, throttled=False, retry_after=None):
+        if changes and not throttled:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff_factor, self.max_interval)
+
+        # Jitter first, so it can never take the delay below a Retry-After
+        delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
@@ -1,11 +1,17 @@
 import datetime
+import hashlib
 import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import publisher_planning
 from dotenv import load_dotenv
 import mysql.connector
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
-import googleapiclient.errors
+import db_pool
+import uuid_keys
+import google_calendar_client
+import metrics
+from googleapiclient.errors import HttpError
 import sys
 import logging
 
@@ -45,20 +51,14 @@ load_dotenv()
 # Email of the service account
 SERVICE_ACCOUNT_EMAIL = os.getenv("SERVICE_ACCOUNT_EMAIL")
 
-# If modifying these scopes, specify the required scopes for accessing Google Calendar.
-SCOPES = ['https://www.googleapis.com/auth/calendar']
+# Number of batch requests sent at the same time when an event change goes to every attendee calendar
+FAN_OUT_WORKERS = int(os.getenv('CALENDAR_FAN_OUT_WORKERS', 4))
 
 
 def connect_to_mysql():
     try:
-        # Connect to MySQL
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT', 3306),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_DATABASE')
-        )
+        # Check out a pooled MySQL connection
+        connection = db_pool.get_connection()
         print("Connected to MySQL database")
         return connection
     except mysql.connector.Error as e:
@@ -67,59 +67,46 @@ def connect_to_mysql():
 
 def create_calendar(user_id):
     # Create a new calendar, add events to it, and save calendar link to the user.
-    # Authenticate using service account credentials
-    creds = service_account.Credentials.from_service_account_info(
-        {
-            "type": "service_account",
-            "project_id": os.getenv("PROJECT_ID"),
-            "private_key_id": os.getenv("PRIVATE_KEY_ID"),
-            "private_key": os.getenv("PRIVATE_KEY").replace("\\n", "\n"),
-            "client_email": os.getenv("CLIENT_EMAIL"),
-            "client_id": os.getenv("CLIENT_ID"),
-            "auth_uri": os.getenv("AUTH_URI"),
-            "token_uri": os.getenv("TOKEN_URI"),
-            "auth_provider_x509_cert_url": os.getenv("AUTH_PROVIDER_X509_CERT_URL"),
-            "client_x509_cert_url": os.getenv("CLIENT_X509_CERT_URL"),
-            "universe_domain": os.getenv("UNIVERSE_DOMAIN")
-        },
-        scopes=SCOPES
-    )
-
-    service = build('calendar', 'v3', credentials=creds)
+    service = google_calendar_client.get_service()
 
     # MySQL Connection
     mysql_connection = connect_to_mysql()
     if mysql_connection is None:
-        return None
+        raise RuntimeError("Database connection failed. Unable to create the calendar.")
 
-    # Check if the user has a calendar ID in the database
-    cursor = mysql_connection.cursor()
-    select_query = "SELECT CalendarId FROM User WHERE UserId = %s"
-    cursor.execute(select_query, (user_id,))
-    result = cursor.fetchone()
-    if result and result[0]:
-        calendar_id = result[0]
-        print("User has an existing calendar. Using calendar ID:", calendar_id)
-    else:
-        # Create a new calendar
-        calendar_id = create_new_calendar(service, mysql_connection, user_id)
-        return calendar_id
+    try:
+        # Check if the user has a calendar ID in the database, a retried task finds the calendar of the first attempt
+        cursor = mysql_connection.cursor()
+        select_query = "SELECT CalendarId FROM User WHERE UserId = %s"
+        cursor.execute(select_query, (uuid_keys.to_db(user_id),))
+        result = cursor.fetchone()
+        cursor.close()
+        mysql_connection.commit()
+        if result and result[0]:
+            calendar_id = result[0]
+            print("User has an existing calendar. Using calendar ID:", calendar_id)
+        else:
+            # Create a new calendar
+            calendar_id = create_new_calendar(service, mysql_connection, user_id)
+    finally:
+        mysql_connection.close()
+    return calendar_id
 
-    cursor.close()
-    mysql_connection.close()
-    
 
-def create_new_calendar(service, mysql_connection, user_id):
+# Function to create a new public calendar owned by the service account, returns (calendar_id, calendar_link)
+def provision_calendar(service):
     # Create a new calendar
     calendar = {
         'summary': 'Integration Project 5',
+        # Marks this calendar, so it can be found again when the answer to calendars.insert got lost
+        'description': f"Planning calendar {uuid.uuid4().hex}",
         'timeZone': 'Europe/Brussels',
         'defaultReminders': [],
         'accessRole': 'owner',
         'role': 'owner'
     }
 
-    created_calendar = service.calendars().insert(body=calendar).execute()
+    created_calendar = insert_calendar(service, calendar)
     print('Calendar created:', created_calendar['id'])
     calendar_id = created_calendar['id']
     calendar_link = f"https://calendar.google.com/calendar/embed?src={calendar_id}"
@@ -132,7 +119,7 @@ def create_new_calendar(service, mysql_connection, user_id):
         },
         'role': 'reader'  # Allow anyone to view the calendar
     }
-    service.acl().insert(calendarId=calendar_id, body=rule).execute()
+    google_calendar_client.execute(service.acl().insert(calendarId=calendar_id, body=rule), 'acl.insert', calendar_id)
     print('Calendar shared publicly')
 
     # Add service account as an owner of the calendar
@@ -143,123 +130,432 @@ def create_new_calendar(service, mysql_connection, user_id):
         },
         'role': 'owner'  # Service account has ownership access
     }
-    service.acl().insert(calendarId=calendar_id, body=rule).execute()
+    google_calendar_client.execute(service.acl().insert(calendarId=calendar_id, body=rule), 'acl.insert', calendar_id)
     print('Permissions granted for service account:', SERVICE_ACCOUNT_EMAIL)
 
-    # Save calendar ID and link to the database
+    return calendar_id, calendar_link
+
+
+# Function to find a calendar of the service account by its description, returns the calendar or None
+def find_calendar(service, description):
+    page_token = None
+    while True:
+        calendars = google_calendar_client.execute(service.calendarList().list(pageToken=page_token), 'calendarList.list')
+        for calendar in calendars.get('items', []):
+            if calendar.get('description') == description:
+                return calendar
+        page_token = calendars.get('nextPageToken')
+        if not page_token:
+            return None
+
+
+# Function to insert a calendar. calendars.insert is not idempotent: after a failure that may have
+# reached Google (5xx, timeout) the calendar is looked up first and only created again when it isn't there.
+def insert_calendar(service, calendar):
+    attempt = 0
+    while True:
+        try:
+            return google_calendar_client.execute(service.calendars().insert(body=calendar), 'calendars.insert', idempotent=False)
+        except Exception as e:
+            if not google_calendar_client.is_retryable(e) or attempt >= google_calendar_client.MAX_RETRIES:
+                raise
+            existing = find_calendar(service, calendar['description'])
+            if existing is not None:
+                logger.warning(f"calendars.insert failed ({e}) but the calendar was created: {existing['id']}")
+                return existing
+            delay = google_calendar_client.backoff_delay(attempt, e)
+            logger.warning(f"calendars.insert failed ({e}), calendar not created, retry {attempt + 1} in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+# Function to claim a ready-made calendar from CalendarPool for a user, returns (calendar_id, calendar_link)
+# or None when the pool is empty. The claim is part of the transaction of the cursor.
+def claim_pooled_calendar(cursor, user_id):
+    # SKIP LOCKED: concurrent claims each take a different calendar instead of waiting on the same row
+    cursor.execute("""
+        SELECT CalendarId, CalendarLink FROM CalendarPool
+        WHERE ClaimedBy IS NULL
+        ORDER BY CreatedAt
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    """)
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    cursor.execute(
+        "UPDATE CalendarPool SET ClaimedBy = %s, ClaimedAt = UTC_TIMESTAMP() WHERE CalendarId = %s",
+        (uuid_keys.to_db(user_id), row[0])
+    )
+    return row[0], row[1]
+
+
+# Function to get the calendar already claimed by a user, returns (calendar_id, calendar_link) or None
+def get_claimed_calendar(cursor, user_id):
+    cursor.execute(
+        "SELECT CalendarId, CalendarLink FROM CalendarPool WHERE ClaimedBy = %s ORDER BY ClaimedAt LIMIT 1",
+        (uuid_keys.to_db(user_id),)
+    )
+    return cursor.fetchone()
+
+
+# Function to give a user a calendar and save it to the user. Errors are raised, so the task is retried.
+# A calendar created inline is recorded in CalendarPool as claimed by the user before anything else
+# happens, so a retry picks it up again instead of creating a second one.
+def create_new_calendar(service, mysql_connection, user_id):
+    cursor = mysql_connection.cursor()
     try:
-        cursor = mysql_connection.cursor()
+        # A calendar claimed or created by an earlier attempt of this task
+        claimed = get_claimed_calendar(cursor, user_id)
+        if claimed is not None:
+            calendar_id, calendar_link = claimed
+            print('Calendar already claimed by the user:', calendar_id)
+        else:
+            # Take a calendar made in advance by the provisioner, only create one when the pool is empty
+            claimed = claim_pooled_calendar(cursor, user_id)
+            if claimed is not None:
+                calendar_id, calendar_link = claimed
+                print('Calendar claimed from the pool:', calendar_id)
+                metrics.increment('calendar_pool.claimed')
+            else:
+                logger.warning("Calendar pool is empty, creating a calendar inline")
+                metrics.increment('calendar_pool.empty')
+                calendar_id, calendar_link = provision_calendar(service)
+                cursor.execute(
+                    "INSERT INTO CalendarPool (CalendarId, CalendarLink, ClaimedBy, CreatedAt, ClaimedAt) "
+                    "VALUES (%s, %s, %s, UTC_TIMESTAMP(), UTC_TIMESTAMP())",
+                    (calendar_id, calendar_link, uuid_keys.to_db(user_id))
+                )
+                mysql_connection.commit()
+
+        # Save calendar ID and link to the database
         logger.debug(calendar_id)
         logger.debug(calendar_link)
         update_query = "UPDATE User SET CalendarId = %s, CalendarLink = %s WHERE UserId = %s"
         logger.debug(update_query)
-        cursor.execute(update_query, (calendar_id, calendar_link, user_id))
+        cursor.execute(update_query, (calendar_id, calendar_link, uuid_keys.to_db(user_id)))
+        # The user XML goes into the outbox in the same transaction as the calendar link
+        publisher_planning.publish_user_xml(user_id, cursor)
         mysql_connection.commit()
         logger.debug(f"Calendar ID and link saved to the database for user:{user_id}")
-        publisher_planning.publish_user_xml(user_id)
-        cursor.close()
-    except mysql.connector.Error as e:
-        logger.error(f"Error updating database:{e}")
+    except Exception as e:
+        logger.error(f"Error saving the calendar of user {user_id}: {e}")
         mysql_connection.rollback()
+        raise
+    finally:
+        cursor.close()
 
     return calendar_id
 
-def add_event_to_calendar(user_id, event_id):
-    creds = service_account.Credentials.from_service_account_info(
-        {
-            "type": "service_account",
-            "project_id": os.getenv("PROJECT_ID"),
-            "private_key_id": os.getenv("PRIVATE_KEY_ID"),
-            "private_key": os.getenv("PRIVATE_KEY").replace("\\n", "\n"),
-            "client_email": os.getenv("CLIENT_EMAIL"),
-            "client_id": os.getenv("CLIENT_ID"),
-            "auth_uri": os.getenv("AUTH_URI"),
-            "token_uri": os.getenv("TOKEN_URI"),
-            "auth_provider_x509_cert_url": os.getenv("AUTH_PROVIDER_X509_CERT_URL"),
-            "client_x509_cert_url": os.getenv("CLIENT_X509_CERT_URL"),
-            "universe_domain": os.getenv("UNIVERSE_DOMAIN")
+
+# Function to build the Google Calendar event body of a (Summary, Start_datetime, End_datetime, Location, Description) row
+def build_event_body(summary, start_datetime, end_datetime, location, description):
+    return {
+        'summary': summary,
+        'start': {
+            'dateTime': start_datetime.isoformat() + 'Z',
         },
-        scopes=SCOPES
-    )
-    service = build('calendar', 'v3', credentials=creds)
+        'end': {
+            'dateTime': end_datetime.isoformat() + 'Z',
+        },
+        'timeZone': 'Europe/Brussels',
+        'location': location,
+        'description': description
+    }
+
+
+# Function to get the Google event ID of the event of a user. Inserts send this ID, so an insert that
+# is sent again (a retry, a task run twice) gets a 409 instead of creating a duplicate event.
+# Google event IDs use the characters 0-9 and a-v, a hex digest fits.
+def google_event_id(user_id, event_id):
+    return hashlib.sha1(f"{user_id}:{event_id}".encode()).hexdigest()
+
+
+# Function to insert, patch or delete many calendar events with Calendar API batch requests.
+# operations is a list of (key, method, calendar_id, params): method is 'insert', 'update', 'patch' or
+# 'delete' and params holds the other arguments of that call (body, eventId). The result is {key: (response, error)},
+# deleting an event that is already gone counts as a success.
+def run_event_batch(service, operations):
+    if not operations:
+        return {}
+    calls = []
+    methods = {}
+    for key, method, calendar_id, params in operations:
+        request = getattr(service.events(), method)(calendarId=calendar_id, **params)
+        calls.append((key, request, calendar_id))
+        methods[key] = method
+
+    # Every event call is idempotent: inserts carry their own event ID (see google_event_id)
+    results = google_calendar_client.execute_batch(service, calls, 'events', idempotent=True)
+    failed = 0
+    for key, (response, error) in results.items():
+        if isinstance(error, HttpError) and methods[key] == 'delete' and error.resp.status in (404, 410):
+            results[key] = (None, None)
+        elif isinstance(error, HttpError) and methods[key] == 'insert' and error.resp.status == 409:
+            # The event ID is taken, the caller decides what to do with the existing event
+            logger.info(f"Calendar event for {key} already exists")
+        elif error is not None:
+            failed += 1
+            logger.error(f"Calendar {methods[key]} for {key} failed: {error}")
+    logger.info(f"Calendar batch of {len(operations)} calls done, {failed} failed")
+    return results
+
+
+# Function to add several events to the calendar of a user in batch requests.
+# Returns {event_id: error} for the events that could not be added, None when the user has no calendar (yet).
+def add_events_to_calendar(user_id, event_ids):
+    if not event_ids:
+        return {}
+    # Events.Id is an INT, service IDs may arrive as text
+    event_ids = [int(event_id) for event_id in event_ids]
+    service = google_calendar_client.get_service()
 
     # MySQL Connection
     mysql_connection = connect_to_mysql()
     if mysql_connection is None:
         return None
 
-    # Fetch calendar_id associated with user_id
-    cursor = mysql_connection.cursor()
-    select_query = "SELECT CalendarId FROM User WHERE UserId = %s"
-    cursor.execute(select_query, (user_id,))
-    result = cursor.fetchone()
-    if result and result[0]:
+    try:
+        # Fetch calendar_id associated with user_id
+        cursor = mysql_connection.cursor()
+        select_query = "SELECT CalendarId FROM User WHERE UserId = %s"
+        cursor.execute(select_query, (uuid_keys.to_db(user_id),))
+        result = cursor.fetchone()
+        if not (result and result[0]):
+            print("Calendar ID not found for user with ID:", user_id)
+            cursor.close()
+            return None
         calendar_id = result[0]
-    else:
-        print("Calendar ID not found for user with ID:", user_id)
+
+        # Fetch the details of every event in one query
+        placeholders = ', '.join(['%s'] * len(event_ids))
+        select_query = f"SELECT Id, Summary, Start_datetime, End_datetime, Location, Description FROM Events WHERE Id IN ({placeholders})"
+        cursor.execute(select_query, list(event_ids))
+        rows = cursor.fetchall()
+
+        found = {row[0] for row in rows}
+        for event_id in event_ids:
+            if event_id not in found:
+                print("Event with id", event_id, "not found in the database.")
+
+        # Events already on the calendar are skipped, so a task that is run again adds no duplicates
+        select_query = f"SELECT EventId FROM CalendarEventMappings WHERE UserId = %s AND EventId IN ({placeholders})"
+        cursor.execute(select_query, [uuid_keys.to_db(user_id)] + list(event_ids))
+        already_added = {row[0] for row in cursor.fetchall()}
+
+        # So are events the user is no longer registered for: tasks run in parallel and a failed add
+        # is retried later, a delete_event task that overtook this one must not be undone
+        select_query = f"SELECT EventId FROM Attendance WHERE UserId = %s AND EventId IN ({placeholders})"
+        cursor.execute(select_query, [uuid_keys.to_db(user_id)] + list(event_ids))
+        registered = {row[0] for row in cursor.fetchall()}
+        mysql_connection.commit()
         cursor.close()
-        mysql_connection.close()
-        return
+        for event_id in found - registered:
+            logger.info(f"User {user_id} is not registered for event {event_id}, not adding it")
 
-    # Fetch event details from the database
-    select_query = "SELECT * FROM Events WHERE Id = %s"
-    cursor.execute(select_query, (event_id,))
-    event_details = cursor.fetchone()
-
-    if event_details:
-        # Construct event body
-        event_body = {
-            'summary': event_details[2],  # Assuming summary is at index 1 in the database
-            'start': {
-                'dateTime': event_details[3].isoformat()+ 'Z',  # Assuming start datetime is at index 2
-            },
-            'end': {
-                'dateTime': event_details[4].isoformat()+ 'Z',  # Assuming end datetime is at index 3
-            },
-            'timeZone': 'Europe/Brussels',
-            'location': event_details[5],  # Assuming location is at index 4
-            'description': event_details[6]  # Assuming description is at index 5
+        bodies = {
+            row[0]: dict(build_event_body(*row[1:]), id=google_event_id(user_id, row[0]))
+            for row in rows if row[0] not in already_added and row[0] in registered
         }
+        operations = [(event_id, 'insert', calendar_id, {'body': body}) for event_id, body in bodies.items()]
+        results = run_event_batch(service, operations)
+
+        # 409: the event is already there, added by an earlier attempt or left cancelled when the user
+        # unregistered before. Updating it with its full body (confirmed again) makes it current.
+        existing = [
+            event_id for event_id, (created_event, error) in results.items()
+            if isinstance(error, HttpError) and error.resp.status == 409
+        ]
+        if existing:
+            operations = [
+                (event_id, 'update', calendar_id, {'eventId': bodies[event_id]['id'], 'body': dict(bodies[event_id], status='confirmed')})
+                for event_id in existing
+            ]
+            results.update(run_event_batch(service, operations))
+
+        # Remember the Google event IDs so the events can be deleted directly later on
+        mappings = [
+            (event_id, calendar_id, created_event['id'])
+            for event_id, (created_event, error) in results.items() if error is None
+        ]
+        for mapping in mappings:
+            print('Event added to Google Calendar:', mapping[2])
+        save_google_event_ids(mysql_connection, user_id, mappings)
+
+        return {event_id: error for event_id, (created_event, error) in results.items() if error is not None}
+    finally:
+        mysql_connection.close()
 
-        # Insert event into Google Calendar
-        created_event = service.events().insert(calendarId=calendar_id, body=event_body).execute()
-        print('Event added to Google Calendar:', created_event['id'])
-    else:
-        print("Event with id", event_id, "not found in the database.")
 
+# Function to run event operations (see run_event_batch) in several batch requests at the same time.
+# Every thread uses its own service object, they are not thread-safe.
+def run_event_batches(operations):
+    if not operations:
+        return {}
+    size = google_calendar_client.BATCH_SIZE
+    chunks = [operations[start:start + size] for start in range(0, len(operations), size)]
+    if len(chunks) == 1:
+        return run_event_batch(google_calendar_client.get_service(), operations)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(FAN_OUT_WORKERS, len(chunks)), thread_name_prefix='calendar-fan-out') as executor:
+        for chunk_results in executor.map(lambda chunk: run_event_batch(google_calendar_client.get_service(), chunk), chunks):
+            results.update(chunk_results)
+    return results
+
+
+# Function to raise when calls of a fan-out failed with an error that may go away, so the task is retried
+def raise_for_retryable_failures(results, action):
+    errors = [error for response, error in results.values() if error is not None and google_calendar_client.is_retryable(error)]
+    if errors:
+        raise RuntimeError(f"{len(errors)} calendar {action} calls failed, last error: {errors[-1]}")
+
+
+# Function to delete CalendarEventMappings rows of an event, user_ids as UUID strings
+def delete_event_mappings(mysql_connection, event_id, user_ids):
+    if not user_ids:
+        return
+    cursor = mysql_connection.cursor()
+    cursor.executemany(
+        "DELETE FROM CalendarEventMappings WHERE UserId = %s AND EventId = %s",
+        [(uuid_keys.to_db(user_id), event_id) for user_id in user_ids]
+    )
+    mysql_connection.commit()
     cursor.close()
-    mysql_connection.close()
+
+
+# Function to copy the current details of an event to the calendar of every attendee
+def update_event_for_attendees(event_id):
+    mysql_connection = connect_to_mysql()
+    if mysql_connection is None:
+        raise RuntimeError("Database connection failed")
+
+    try:
+        cursor = mysql_connection.cursor()
+        cursor.execute("SELECT Summary, Start_datetime, End_datetime, Location, Description FROM Events WHERE Id = %s", (event_id,))
+        event_details = cursor.fetchone()
+        cursor.execute("SELECT UserId, CalendarId, GoogleEventId FROM CalendarEventMappings WHERE EventId = %s", (event_id,))
+        mappings = cursor.fetchall()
+        mysql_connection.commit()
+        cursor.close()
+        if event_details is None:
+            logger.warning(f"Event {event_id} not found, nothing to update")
+            return
+
+        body = build_event_body(*event_details)
+        # Results are keyed by the UUID string, a BINARY(16) UserId comes back as an unhashable bytearray
+        operations = [
+            (uuid_keys.from_db(user_id), 'patch', calendar_id, {'eventId': google_event_id, 'body': body})
+            for user_id, calendar_id, google_event_id in mappings
+        ]
+        results = run_event_batches(operations)
+
+        # Attendees who removed the event from their calendar themselves don't need the mapping any more
+        gone = [
+            user_id for user_id, (response, error) in results.items()
+            if isinstance(error, HttpError) and error.resp.status in (404, 410)
+        ]
+        delete_event_mappings(mysql_connection, event_id, gone)
+        logger.info(f"Event {event_id} updated on {len(mappings)} attendee calendars")
+        raise_for_retryable_failures(results, 'patch')
+    finally:
+        mysql_connection.close()
+
+
+# Function to delete an event from the calendar of every attendee
+def delete_event_for_attendees(event_id):
+    mysql_connection = connect_to_mysql()
+    if mysql_connection is None:
+        raise RuntimeError("Database connection failed")
+
+    try:
+        cursor = mysql_connection.cursor()
+        cursor.execute("SELECT UserId, CalendarId, GoogleEventId FROM CalendarEventMappings WHERE EventId = %s", (event_id,))
+        mappings = cursor.fetchall()
+        mysql_connection.commit()
+        cursor.close()
+
+        # Results are keyed by the UUID string, a BINARY(16) UserId comes back as an unhashable bytearray
+        operations = [
+            (uuid_keys.from_db(user_id), 'delete', calendar_id, {'eventId': google_event_id})
+            for user_id, calendar_id, google_event_id in mappings
+        ]
+        results = run_event_batches(operations)
+
+        # Only the mappings of deleted events go, a retry of the task deletes the rest
+        deleted = [user_id for user_id, (response, error) in results.items() if error is None]
+        delete_event_mappings(mysql_connection, event_id, deleted)
+        logger.info(f"Event {event_id} deleted from {len(deleted)} of {len(mappings)} attendee calendars")
+        raise_for_retryable_failures(results, 'delete')
+    finally:
+        mysql_connection.close()
+
+
+def add_event_to_calendar(user_id, event_id):
+    event_id = int(event_id)
+    failed = add_events_to_calendar(user_id, [event_id])
+    if failed is None:
+        # The calendar task of a new user may not have run yet, the caller can try again later
+        raise LookupError(f"No calendar for user {user_id}")
+    if event_id in failed:
+        raise failed[event_id]
+
+
+# Function to store the mappings of several calendar events of one user, mappings are (EventId, CalendarId, GoogleEventId)
+def save_google_event_ids(mysql_connection, user_id, mappings):
+    if not mappings:
+        return
+    try:
+        cursor = mysql_connection.cursor()
+        insert_query = """
+            INSERT INTO CalendarEventMappings (UserId, EventId, CalendarId, GoogleEventId)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE CalendarId = VALUES(CalendarId), GoogleEventId = VALUES(GoogleEventId)
+        """
+        user_key = uuid_keys.to_db(user_id)
+        cursor.executemany(insert_query, [(user_key, event_id, calendar_id, google_event_id) for event_id, calendar_id, google_event_id in mappings])
+        mysql_connection.commit()
+        cursor.close()
+    except mysql.connector.Error as e:
+        logger.error(f"Error saving Google event ID:{e}")
+        mysql_connection.rollback()
 
 
 def delete_event_by_id(user_id, event_id):
-    # Authenticate using service account credentials
-    creds = service_account.Credentials.from_service_account_info(
-        {
-            "type": "service_account",
-            "project_id": os.getenv("PROJECT_ID"),
-            "private_key_id": os.getenv("PRIVATE_KEY_ID"),
-            "private_key": os.getenv("PRIVATE_KEY").replace("\\n", "\n"),
-            "client_email": os.getenv("CLIENT_EMAIL"),
-            "client_id": os.getenv("CLIENT_ID"),
-            "auth_uri": os.getenv("AUTH_URI"),
-            "token_uri": os.getenv("TOKEN_URI"),
-            "auth_provider_x509_cert_url": os.getenv("AUTH_PROVIDER_X509_CERT_URL"),
-            "client_x509_cert_url": os.getenv("CLIENT_X509_CERT_URL"),
-            "universe_domain": os.getenv("UNIVERSE_DOMAIN")
-        },
-        scopes=SCOPES
-    )
-    service = build('calendar', 'v3', credentials=creds)
+    service = google_calendar_client.get_service()
 
     # MySQL Connection
     mysql_connection = connect_to_mysql()
     if mysql_connection is None:
-        return None
+        raise RuntimeError("Database connection failed")
 
-    # Fetch calendar_id associated with user_id
+    # Look up the Google event ID stored when the event was added
     cursor = mysql_connection.cursor()
+    select_mapping_query = "SELECT CalendarId, GoogleEventId FROM CalendarEventMappings WHERE UserId = %s AND EventId = %s"
+    cursor.execute(select_mapping_query, (uuid_keys.to_db(user_id), event_id))
+    mapping = cursor.fetchone()
+
+    if mapping:
+        calendar_id, google_event_id = mapping
+        try:
+            google_calendar_client.execute(service.events().delete(calendarId=calendar_id, eventId=google_event_id), 'events.delete', calendar_id)
+            logger.info(f"Event '{google_event_id}' has been deleted from Google Calendar.")
+        except HttpError as e:
+            # 404/410: the event is already gone, anything else is a real failure
+            if e.resp.status not in (404, 410):
+                cursor.close()
+                mysql_connection.close()
+                raise
+            logger.warning(f"Event '{google_event_id}' was already deleted from Google Calendar.")
+
+        cursor.execute("DELETE FROM CalendarEventMappings WHERE UserId = %s AND EventId = %s", (uuid_keys.to_db(user_id), event_id))
+        mysql_connection.commit()
+        cursor.close()
+        mysql_connection.close()
+        return
+
     select_query = "SELECT CalendarId FROM User WHERE UserId = %s"
-    cursor.execute(select_query, (user_id,))
+    cursor.execute(select_query, (uuid_keys.to_db(user_id),))
     result = cursor.fetchone()
     if result and result[0]:
         calendar_id = result[0]
@@ -269,6 +565,29 @@ def delete_event_by_id(user_id, event_id):
         mysql_connection.close()
         return
 
+    # No mapping (yet): an add_event task that is still running or waiting for a retry inserts the
+    # event under its own ID (see google_event_id), so delete that ID directly
+    try:
+        google_calendar_client.execute(
+            service.events().delete(calendarId=calendar_id, eventId=google_event_id(user_id, event_id)), 'events.delete', calendar_id
+        )
+        logger.info(f"Event {event_id} has been deleted from the calendar of user {user_id}.")
+        cursor.close()
+        mysql_connection.close()
+        return
+    except HttpError as e:
+        if e.resp.status == 410:
+            # Deleted before
+            cursor.close()
+            mysql_connection.close()
+            return
+        if e.resp.status != 404:
+            cursor.close()
+            mysql_connection.close()
+            raise
+
+    # Events added before event IDs were set by us: fall back to matching on the summary
+
     # Fetch event summary from the database using event ID
     select_event_query = "SELECT Summary FROM Events WHERE Id = %s"
     cursor.execute(select_event_query, (event_id,))
@@ -284,26 +603,27 @@ def delete_event_by_id(user_id, event_id):
     cursor.close()
     mysql_connection.close()
 
-    # List all events in the calendar
-    events_result = service.events().list(calendarId=calendar_id).execute()
-    events = events_result.get('items', [])
-
-    # Find and delete the event with the matching summary
+    # Find the event with the matching summary, going through every page of the calendar
     event_to_delete = None
-    for event in events:
-        if event['summary'] == event_summary:
-            event_to_delete = event['id']
+    page_token = None
+    while event_to_delete is None:
+        events_result = google_calendar_client.execute(
+            service.events().list(calendarId=calendar_id, q=event_summary, pageToken=page_token), 'events.list', calendar_id
+        )
+        for event in events_result.get('items', []):
+            if event.get('summary') == event_summary:
+                event_to_delete = event['id']
+                break
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
             break
 
     if event_to_delete:
-        service.events().delete(calendarId=calendar_id, eventId=event_to_delete).execute()
+        google_calendar_client.execute(service.events().delete(calendarId=calendar_id, eventId=event_to_delete), 'events.delete', calendar_id)
         logger.info(f"Event with summary '{event_summary}' has been deleted from Google Calendar.")
     else:
         logger.warning(f"No event found with summary '{event_summary}' in Google Calendar.")
 
-    cursor.close()
-    mysql_connection.close()
-
 
 #if __name__ == '__main__':
  #user_id_from_rabbitmq = 'dab9414f-5530-4ddc-920a-1fd74a31c415' # Hardcoded, make it a comment when we use function calls
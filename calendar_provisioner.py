@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+import datetime
+import logging
+import mysql.connector
+from dotenv import load_dotenv
+import db_pool
+import metrics
+import monitoring_shipper
+import calendar_events
+import google_calendar_client
+
+# Create a custom logger
+logger = logging.getLogger(__name__)
+
+# Set the level of this logger.
+logger.setLevel(logging.DEBUG)
+
+# Create handlers
+c_handler = logging.StreamHandler()
+s_handler = logging.StreamHandler(sys.stdout)
+c_handler.setLevel(logging.DEBUG)
+s_handler.setLevel(logging.DEBUG)
+
+# Create formatters and add it to handlers
+c_format = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+s_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+c_handler.setFormatter(c_format)
+s_handler.setFormatter(s_format)
+
+# Add handlers to the logger
+logger.addHandler(c_handler)
+logger.addHandler(s_handler)
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Number of unclaimed, ready-made calendars kept in CalendarPool. New users
+# claim one of them (see calendar_events.create_new_calendar) instead of
+# waiting for three Calendar API calls.
+POOL_SIZE = int(os.getenv('CALENDAR_POOL_SIZE', 20))
+
+# Below this many unclaimed calendars the pool is refilled straight away,
+# otherwise only during the off-peak hours
+POOL_MIN = int(os.getenv('CALENDAR_POOL_MIN', 5))
+
+# Off-peak hours (UTC) as 'start-end', e.g. '22-6'. Empty means any time.
+POOL_OFF_PEAK = os.getenv('CALENDAR_POOL_OFF_PEAK', '')
+
+# Seconds between two checks of the pool
+POOL_INTERVAL = float(os.getenv('CALENDAR_POOL_INTERVAL', 60))
+
+# Only one provisioner refills the pool at a time, or they would overfill it
+POOL_LOCK_NAME = 'planning_calendar_pool'
+
+
+# Function to tell whether the given UTC hour falls in the off-peak hours
+def is_off_peak(hour):
+    if not POOL_OFF_PEAK:
+        return True
+    start, end = (int(part) for part in POOL_OFF_PEAK.split('-'))
+    if start <= end:
+        return start <= hour < end
+    # The off-peak hours go past midnight
+    return hour >= start or hour < end
+
+
+# Function to count the unclaimed calendars in the pool
+def count_available(mysql_connection):
+    cursor = mysql_connection.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM CalendarPool WHERE ClaimedBy IS NULL")
+        available = cursor.fetchone()[0]
+        mysql_connection.commit()
+        return available
+    finally:
+        cursor.close()
+
+
+# Function to create one calendar and add it to the pool
+def add_calendar(service, mysql_connection):
+    calendar_id, calendar_link = calendar_events.provision_calendar(service)
+    cursor = mysql_connection.cursor()
+    try:
+        cursor.execute(
+            "INSERT INTO CalendarPool (CalendarId, CalendarLink, CreatedAt) VALUES (%s, %s, UTC_TIMESTAMP())",
+            (calendar_id, calendar_link)
+        )
+        mysql_connection.commit()
+    except mysql.connector.Error:
+        mysql_connection.rollback()
+        logger.error(f"Calendar {calendar_id} was created but could not be added to the pool")
+        raise
+    finally:
+        cursor.close()
+
+
+# Function to top up the pool, returns the number of calendars added
+def refill_pool(mysql_connection):
+    available = count_available(mysql_connection)
+    metrics.set_gauge('calendar_pool.available', available)
+    if available >= POOL_SIZE:
+        return 0
+    if available >= POOL_MIN and not is_off_peak(datetime.datetime.utcnow().hour):
+        return 0
+
+    service = google_calendar_client.get_service()
+    added = 0
+    for _ in range(POOL_SIZE - available):
+        add_calendar(service, mysql_connection)
+        added += 1
+        metrics.increment('calendar_pool.provisioned')
+    metrics.set_gauge('calendar_pool.available', available + added)
+    logger.info(f"{added} calendars added to the pool")
+    return added
+
+
+def run_provisioner():
+    while True:
+        try:
+            mysql_connection = db_pool.get_connection()
+            try:
+                cursor = mysql_connection.cursor()
+                cursor.execute("SELECT GET_LOCK(%s, 0)", (POOL_LOCK_NAME,))
+                locked = cursor.fetchone()[0] == 1
+                try:
+                    if locked:
+                        refill_pool(mysql_connection)
+                finally:
+                    if locked:
+                        cursor.execute("SELECT RELEASE_LOCK(%s)", (POOL_LOCK_NAME,))
+                        cursor.fetchone()
+                    cursor.close()
+            finally:
+                mysql_connection.close()
+        except Exception as e:
+            logger.error(f"Error refilling the calendar pool: {e}")
+        time.sleep(POOL_INTERVAL)
+
+
+if __name__ == '__main__':
+    monitoring_shipper.start_metrics_reporter()
+    run_provisioner()
@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import pika
+from dotenv import load_dotenv
+from googleapiclient.errors import HttpError
+import calendar_events
+import google_calendar_client
+import metrics
+import monitoring_shipper
+import outbox
+
+# Create a custom logger
+logger = logging.getLogger(__name__)
+
+# Set the level of this logger.
+logger.setLevel(logging.DEBUG)
+
+# Create handlers
+c_handler = logging.StreamHandler()
+s_handler = logging.StreamHandler(sys.stdout)
+c_handler.setLevel(logging.DEBUG)
+s_handler.setLevel(logging.DEBUG)
+
+# Create formatters and add it to handlers
+c_format = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+s_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+c_handler.setFormatter(c_format)
+s_handler.setFormatter(s_format)
+
+# Add handlers to the logger
+logger.addHandler(c_handler)
+logger.addHandler(s_handler)
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Google Calendar work is done here instead of in the consumer, so user and
+# attendance messages don't wait for the Calendar API. Tasks are JSON messages
+# on a durable queue. A failed task is parked in the retry queue until its TTL
+# runs out, then dead-lettered back onto the work queue. After
+# CALENDAR_MAX_ATTEMPTS attempts it goes to the dead queue for inspection.
+TASK_QUEUE = 'planning.calendar'
+RETRY_QUEUE = 'planning.calendar.retry'
+DEAD_QUEUE = 'planning.calendar.dead'
+
+# Number of tasks handled at the same time
+CALENDAR_WORKERS = int(os.getenv('CALENDAR_WORKERS', 4))
+# Maximum number of unacked tasks the broker sends to this worker
+CALENDAR_PREFETCH = int(os.getenv('CALENDAR_PREFETCH', max(CALENDAR_WORKERS, 1) * 2))
+# Attempts of a task before it is dead-lettered
+CALENDAR_MAX_ATTEMPTS = int(os.getenv('CALENDAR_MAX_ATTEMPTS', 5))
+# Seconds a failed task waits in the retry queue. This is an argument of the
+# retry queue, delete the queue when changing it or the declare will fail.
+CALENDAR_RETRY_DELAY = int(os.getenv('CALENDAR_RETRY_DELAY', 30))
+
+ATTEMPT_HEADER = 'x-attempt'
+
+# Task name -> function doing it, called with the parameters of the task
+TASKS = {
+    'create_calendar': lambda user_id: calendar_events.create_calendar(user_id),
+    'add_event': lambda user_id, event_id: calendar_events.add_event_to_calendar(user_id, event_id),
+    'delete_event': lambda user_id, event_id: calendar_events.delete_event_by_id(user_id, event_id),
+    'update_event_attendees': lambda event_id: calendar_events.update_event_for_attendees(event_id),
+    'delete_event_attendees': lambda event_id: calendar_events.delete_event_for_attendees(event_id),
+}
+
+
+# Function to declare the work, retry and dead queues on a channel
+def declare_queues(channel):
+    channel.queue_declare(queue=TASK_QUEUE, durable=True)
+    channel.queue_declare(queue=RETRY_QUEUE, durable=True, arguments={
+        'x-message-ttl': CALENDAR_RETRY_DELAY * 1000,
+        'x-dead-letter-exchange': '',
+        'x-dead-letter-routing-key': TASK_QUEUE,
+    })
+    channel.queue_declare(queue=DEAD_QUEUE, durable=True)
+
+
+# Function to queue a calendar task, e.g. enqueue(cursor, 'add_event', user_id=..., event_id=...).
+# The task goes into the outbox in the caller's transaction, so it is sent if and only if the
+# change that needs it commits. A task without the attempt header is on its first attempt.
+def enqueue(cursor, task, **params):
+    if task not in TASKS:
+        raise ValueError(f"Unknown calendar task: {task}")
+    body = json.dumps({'task': task, 'params': params})
+    entity_id = params.get('user_id', params.get('event_id'))
+    outbox.enqueue(cursor, 'calendar_task', entity_id, '', TASK_QUEUE, body)
+    metrics.increment(f"calendar_tasks.queued.{task}")
+
+
+# Function to run one task message
+def run_task(body):
+    message = json.loads(body)
+    task = message['task']
+    with metrics.timed(f"calendar_tasks.{task}"):
+        TASKS[task](**message['params'])
+    logger.info(f"Calendar task {task} {message['params']} done")
+
+
+# Callback function for consuming tasks, the task is handed to the worker pool
+def on_message(ch, method, properties, body, connection, executor):
+    future = executor.submit(run_task, body)
+    future.add_done_callback(
+        lambda f: connection.add_callback_threadsafe(
+            functools.partial(finish_task, ch, method.delivery_tag, properties, body, f)
+        )
+    )
+
+
+# Function to ack a finished task, a failed one is first moved to the retry or dead queue.
+# Always runs on the connection thread.
+def finish_task(ch, delivery_tag, properties, body, future):
+    if not ch.is_open:
+        # The broker redelivers every unacked message of a closed channel
+        logger.warning(f"Channel closed before task {delivery_tag} could be acked")
+        return
+
+    error = future.exception()
+    if error is None:
+        metrics.increment('calendar_tasks.done')
+        ch.basic_ack(delivery_tag=delivery_tag)
+        return
+
+    headers = dict(properties.headers or {})
+    attempt = int(headers.get(ATTEMPT_HEADER, 1))
+    # A message that can't be read or a request Google rejects will never succeed
+    retryable = not isinstance(error, (ValueError, KeyError, TypeError))
+    if isinstance(error, HttpError):
+        retryable = google_calendar_client.is_retryable(error)
+    if retryable and attempt < CALENDAR_MAX_ATTEMPTS:
+        logger.warning(f"Calendar task failed (attempt {attempt}), retrying in {CALENDAR_RETRY_DELAY}s: {error}")
+        metrics.increment('calendar_tasks.retried')
+        headers[ATTEMPT_HEADER] = attempt + 1
+        target = RETRY_QUEUE
+    else:
+        logger.error(f"Calendar task failed (attempt {attempt}), moved to {DEAD_QUEUE}: {error}")
+        metrics.increment('calendar_tasks.dead')
+        headers['x-error'] = str(error)[:1000]
+        target = DEAD_QUEUE
+
+    republish = pika.BasicProperties(content_type=properties.content_type, delivery_mode=2, headers=headers)
+    ch.basic_publish(exchange='', routing_key=target, body=body, properties=republish)
+    ch.basic_ack(delivery_tag=delivery_tag)
+
+
+def main():
+    # Connect to RabbitMQ server
+    credentials = pika.PlainCredentials(os.getenv('RABBITMQ_USER'), os.getenv('RABBITMQ_PASSWORD'))
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=os.getenv('RABBITMQ_HOST'), credentials=credentials))
+    channel = connection.channel()
+    declare_queues(channel)
+    monitoring_shipper.start_metrics_reporter()
+
+    channel.basic_qos(prefetch_count=CALENDAR_PREFETCH)
+    executor = ThreadPoolExecutor(max_workers=max(CALENDAR_WORKERS, 1), thread_name_prefix='calendar-worker')
+    on_message_callback = functools.partial(on_message, connection=connection, executor=executor)
+    channel.basic_consume(queue=TASK_QUEUE, on_message_callback=on_message_callback)
+
+    print('Waiting for calendar tasks...')
+    try:
+        channel.start_consuming()
+    finally:
+        executor.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,19 @@ import pika
 from lxml import etree
 from dotenv import load_dotenv
 import mysql.connector
-import calendar_events
+import db_pool
+import calendar_worker
+import seat_reservations
 import logging
 import sys
-import requests
-import json
 import publisher_planning
+import master_uuid_client
+import uuid_keys
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import monitoring_shipper
 
 # Create a custom logger
 logger = logging.getLogger(__name__)
@@ -43,6 +50,23 @@ logger.error('This is an error')
 # Load environment variables from .env file
 load_dotenv()
 
+# Number of handler threads, 0 handles messages inline on the connection thread
+CONSUMER_WORKERS = int(os.getenv('CONSUMER_WORKERS', 4))
+# Maximum number of unacked messages the broker sends to this consumer
+CONSUMER_PREFETCH = int(os.getenv('CONSUMER_PREFETCH', max(CONSUMER_WORKERS, 1) * 2))
+
+# A failed message is parked in the retry queue until its TTL runs out, then
+# dead-lettered back onto the planning queue. After CONSUMER_MAX_ATTEMPTS
+# attempts it goes to the dead queue for inspection (see calendar_worker.py).
+QUEUE = 'planning'
+RETRY_QUEUE = 'planning.retry'
+DEAD_QUEUE = 'planning.dead'
+CONSUMER_MAX_ATTEMPTS = int(os.getenv('CONSUMER_MAX_ATTEMPTS', 5))
+# Seconds a failed message waits in the retry queue. This is an argument of the
+# retry queue, delete the queue when changing it or the declare will fail.
+CONSUMER_RETRY_DELAY = int(os.getenv('CONSUMER_RETRY_DELAY', 30))
+ATTEMPT_HEADER = 'x-attempt'
+
 # Embedded XSD schemas
 XSD_SCHEMAS = {
     'user': """
@@ -377,76 +401,36 @@ XSD_SCHEMAS = {
     """,
 }
 
-headers = {
-        "Content-Type": "application/json"  # Set content type to JSON
-    }
-
-def add_service_id(master_uuid, service, service_id):
-    url = f"http://{os.getenv('RABBITMQ_HOST')}:6000/addServiceId"
-    payload = {
-        "MasterUuid": master_uuid,
-        "Service": service,
-        "ServiceId": service_id
-    }
-
-   
-
-    try:
-        response = requests.post(url, data=json.dumps(payload), headers=headers)
-        response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-        
-        if response.status_code in (200, 201):
-            return response.json()
-        else:
-            logger.error(f"Unexpected response: {response.status_code} - {response.text}")
-            return None
-            
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error during request: {e}")
-        return None
-
-def delete_service_id(master_uuid, service):
-    url = f"http://{os.getenv('RABBITMQ_HOST')}:6000/updateServiceId"
-    payload = {
-        "MASTERUUID": master_uuid,
-        "NewServiceId": None,
-        "Service": service
-    }
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return None
-    
+# Compile every embedded XSD schema once at startup, keyed by root element tag.
+# A compiled schema keeps its own error log, so validation against it is
+# serialised with a per-schema lock.
+SCHEMA_REGISTRY = {
+    root_tag: (etree.XMLSchema(etree.fromstring(xsd_str)), threading.Lock())
+    for root_tag, xsd_str in XSD_SCHEMAS.items()
+}
 
-def get_service_id(master_uuid, service_name):
-    url = f"http://{os.getenv('RABBITMQ_HOST')}:6000/getServiceId"
-    payload = {
-        "MASTERUUID": master_uuid,
-        "Service": service_name
-    }
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
-    if response.status_code == 200:
-        return response.json()[service_name]
-    else:
-        return None
-    
 # Function to validate XML against embedded XSD schema
 def validate_xml(xml_str):
     try:
         logger.debug(xml_str)
         root = etree.fromstring(xml_str)
-        if root.tag in XSD_SCHEMAS:
-            xsd_str = XSD_SCHEMAS[root.tag]
-            xmlschema = etree.XMLSchema(etree.fromstring(xsd_str))
-            xmlparser = etree.XMLParser(schema=xmlschema)
-            etree.fromstring(xml_str, xmlparser)
-            return True, root  # Valid XML and root element
-        else:
-            return False, f"No schema available for the received XML root element '{root.tag}'"
-    except etree.XMLSchemaError as e:
+    except etree.XMLSyntaxError as e:
         logger.debug(e)
-        return False, str(e)  # Invalid XML
+        return False, str(e)  # Malformed XML
+
+    if root.tag not in SCHEMA_REGISTRY:
+        return False, f"No schema available for the received XML root element '{root.tag}'"
+
+    xmlschema, schema_lock = SCHEMA_REGISTRY[root.tag]
+    with metrics.timed(f"xml_validation.{root.tag}"):
+        with schema_lock:
+            is_valid = xmlschema.validate(root)
+            error = None if is_valid else str(xmlschema.error_log.last_error)
+
+    if is_valid:
+        return True, root  # Valid XML and root element
+    logger.debug(error)
+    return False, error  # Invalid XML
 
 # Function to establish a database connection
 def get_database_connection():
@@ -456,13 +440,7 @@ def get_database_connection():
     logger.debug(os.getenv('DB_DATABASE'))
     
     try: 
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT', 3306),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_DATABASE')
-        )
+        connection = db_pool.get_connection()
         logger.debug(connection)
         logger.info(connection)  # This line is not recommended; use it for debugging only
         publisher_planning.sendLogsToMonitoring("connection_to_database_consumer", connection, False)
@@ -500,20 +478,21 @@ def save_user_to_database(root_element):
             
             user_id = id_elem.text
             conn = get_database_connection()
-            
-            if conn is not None:
+            if conn is None:
+                raise RuntimeError("Database connection failed. Unable to delete user data.")
+
+            try:
                 cursor = conn.cursor()
                 sql = "DELETE FROM User WHERE UserId = %s"
-                cursor.execute(sql, (user_id,))
+                cursor.execute(sql, (uuid_keys.to_db(user_id),))
                 conn.commit()
                 cursor.close()
+            finally:
                 conn.close()
-                logger.info(f"User data with ID '{user_id}' deleted successfully.")
-                logs = f"User data with ID '{user_id}' deleted successfully."
-                publisher_planning.sendLogsToMonitoring("User_deleted", logs, False)
-                delete_service_id(user_id,'planning')
-            else:
-                logger.error("Database connection failed. Unable to delete user data.")
+            logger.info(f"User data with ID '{user_id}' deleted successfully.")
+            logs = f"User data with ID '{user_id}' deleted successfully."
+            publisher_planning.sendLogsToMonitoring("User_deleted", logs, False)
+            master_uuid_client.delete_service_id(user_id,'planning')
         
         else:  # For create and update operations
             if id_elem is None:
@@ -540,21 +519,26 @@ def save_user_to_database(root_element):
                 company_id = None
 
             conn = get_database_connection()
+            if conn is None:
+                raise RuntimeError("Database connection failed. Unable to save user data.")
 
-            if conn is not None:
+            try:
                 cursor = conn.cursor()
 
                 if crud_operation == 'create':
                     sql = "INSERT INTO User (UserId, First_name, Last_name, Email, CompanyId) VALUES (%s, %s, %s, %s, %s)"
-                    values = (user_id, first_name, last_name, email, company_id)
+                    values = (uuid_keys.to_db(user_id), first_name, last_name, email, uuid_keys.to_db(company_id))
                     cursor.execute(sql, values)
+                    # The calendar is created by the calendar worker (see calendar_worker.py), the task
+                    # goes through the outbox in the same transaction as the new user
+                    calendar_worker.enqueue(cursor, 'create_calendar', user_id=user_id)
                     conn.commit()
                     logger.info("User data saved to the database successfully.")
                     log_create = "User data saved to the database successfully."
                     publisher_planning.sendLogsToMonitoring("User_created", log_create, False)
                 elif crud_operation == 'update':
                     select_user = "SELECT First_name, Last_name, Email, CompanyId FROM User WHERE UserId = %s"
-                    cursor.execute(select_user, (user_id,))
+                    cursor.execute(select_user, (uuid_keys.to_db(user_id),))
                     current_data = cursor.fetchone()
                     if current_data is None:
                         logger.error(f"User with ID '{user_id}' not found.")
@@ -568,28 +552,26 @@ def save_user_to_database(root_element):
                         company_id = company_id if company_id is not None else current_company_id
 
                 sql = "UPDATE User SET First_name = %s, Last_name = %s, Email = %s, CompanyId = %s WHERE UserId = %s"
-                values = (first_name, last_name, email, company_id, user_id)
+                values = (first_name, last_name, email, uuid_keys.to_db(company_id), uuid_keys.to_db(user_id))
                 cursor.execute(sql, values)
                 conn.commit()
                 logger.info(f"User data with ID '{user_id}' updated successfully.")
                 log_update = f"User data with ID '{user_id}' updated successfully."
                 publisher_planning.sendLogsToMonitoring("User_updated", log_update, False)
 
-
                 cursor.close()
+            finally:
                 conn.close()
 
-                # Add service ID and create calendar event for new users
-                if crud_operation == 'create':
-                    logger.info("TestTest")
-                    add_service_id(user_id, 'planning', user_id)
-                    calendar_events.create_calendar(user_id)
-
-            else:
-                logger.error("Database connection failed. Unable to save user data.")
+            # Add service ID for new users
+            if crud_operation == 'create':
+                logger.info("TestTest")
+                master_uuid_client.add_service_id(user_id, 'planning', user_id)
 
     except Exception as e:
         logger.error(f"Error saving user data to database: {str(e)}")
+        # The message goes to the retry queue and is tried again
+        raise
 
 # Function to save company data to the database
 def save_company_to_database(root_element):
@@ -607,72 +589,105 @@ def save_company_to_database(root_element):
         
         company_id = id_elem.text
 
+        name_elem = root_element.find('name')
+        email_elem = root_element.find('email')
+        if crud_operation != 'delete' and (name_elem is None or email_elem is None):
+            logger.error("One or more required elements (name, email) are missing in the XML.")
+            return
+
         conn = get_database_connection()
         if conn is None:
-            logger.error("Database connection failed. Unable to perform the operation.")
-            return
+            raise RuntimeError("Database connection failed. Unable to perform the operation.")
 
-        cursor = conn.cursor()
+        try:
+            save_company(conn, crud_operation, company_id, name_elem, email_elem)
+        finally:
+            conn.close()
 
-        if crud_operation == 'delete':
-            sql = "DELETE FROM Company WHERE CompanyId = %s"
-            cursor.execute(sql, (company_id,))
+    except Exception as e:
+        logger.error(f"Error saving company data to database: {str(e)}")
+        # The message goes to the retry queue and is tried again
+        raise
+
+
+# Function to apply a company create, update or delete on a database connection
+def save_company(conn, crud_operation, company_id, name_elem, email_elem):
+    cursor = conn.cursor()
+
+    if crud_operation == 'delete':
+        sql = "DELETE FROM Company WHERE CompanyId = %s"
+        cursor.execute(sql, (uuid_keys.to_db(company_id),))
+        conn.commit()
+        master_uuid_client.delete_service_id(company_id,'planning')
+        logger.info(f"Company data with ID '{company_id}' deleted successfully.")
+        log_delete = f"Company data with ID '{company_id}' deleted successfully."
+        publisher_planning.sendLogsToMonitoring("Company_Deleted", log_delete, False)
+    
+    else:  # For create and update operations
+        name = name_elem.text
+        email = email_elem.text
+
+        if crud_operation == 'create':
+            sql = "INSERT INTO Company (CompanyId, Name, Email) VALUES (%s, %s, %s)"
+            values = (uuid_keys.to_db(company_id), name, email)
+            cursor.execute(sql, values)
             conn.commit()
-            delete_service_id(company_id,'planning')
-            logger.info(f"Company data with ID '{company_id}' deleted successfully.")
-            log_delete = f"Company data with ID '{company_id}' deleted successfully."
-            publisher_planning.sendLogsToMonitoring("Company_Deleted", log_delete, False)
+            master_uuid_client.add_service_id(company_id, 'planning', company_id)
+            logger.info("Company data saved to the database successfully.")
+            log_create = "Company data saved to the database successfully."
+            publisher_planning.sendLogsToMonitoring("Company_created", log_create, False)
         
-        else:  # For create and update operations
-            name_elem = root_element.find('name')
-            email_elem = root_element.find('email')
+        elif crud_operation == 'update':
+            select_company = "SELECT Name, Email FROM Company WHERE CompanyId = %s"
+            cursor.execute(select_company, (uuid_keys.to_db(company_id),))
+            current_data = cursor.fetchone()
             
+            if current_data is None:
+                logger.error(f"Company with ID '{company_id}' not found.")
+            else:
+                current_name, current_email = current_data
 
-            if name_elem is None or email_elem is None:
-                logger.error("One or more required elements (name, email) are missing in the XML.")
-                return
-
-            name = name_elem.text
-            email = email_elem.text
+                # Use current data if no new data is provided
+                name = name if name is not None else current_name
+                email = email if email is not None else current_email
 
-            if crud_operation == 'create':
-                sql = "INSERT INTO Company (CompanyId, Name, Email) VALUES (%s, %s, %s)"
-                values = (company_id, name, email)
+                sql = "UPDATE Company SET Name = %s, Email = %s WHERE CompanyId = %s"
+                values = (name, email, uuid_keys.to_db(company_id))
                 cursor.execute(sql, values)
                 conn.commit()
-                add_service_id(company_id, 'planning', company_id)
-                logger.info("Company data saved to the database successfully.")
-                log_create = "Company data saved to the database successfully."
-                publisher_planning.sendLogsToMonitoring("Company_created", log_create, False)
-            
-            elif crud_operation == 'update':
-                select_company = "SELECT Name, Email FROM Company WHERE CompanyId = %s"
-                cursor.execute(select_company, (company_id,))
-                current_data = cursor.fetchone()
-                
-                if current_data is None:
-                    logger.error(f"Company with ID '{company_id}' not found.")
-                else:
-                    current_name, current_email = current_data
-
-                    # Use current data if no new data is provided
-                    name = name if name is not None else current_name
-                    email = email if email is not None else current_email
-
-                    sql = "UPDATE Company SET Name = %s, Email = %s WHERE CompanyId = %s"
-                    values = (name, email, company_id)
-                    cursor.execute(sql, values)
-                    conn.commit()
-                    logger.info(f"Company data with ID '{company_id}' updated successfully.")
-                    log_update = f"Company data with ID '{company_id}' updated successfully."
-                    publisher_planning.sendLogsToMonitoring("Company_updated", log_update, False)
-
-        cursor.close()
-        conn.close()
-        
-    except Exception as e:
-        logger.error(f"Error saving company data to database: {str(e)}")
-
+                logger.info(f"Company data with ID '{company_id}' updated successfully.")
+                log_update = f"Company data with ID '{company_id}' updated successfully."
+                publisher_planning.sendLogsToMonitoring("Company_updated", log_update, False)
+
+    cursor.close()
+
+
+# Function to read the event details of an event XML, returns
+# (summary, start_datetime, end_datetime, location, description, max_registrations, available_seats)
+def parse_event_details(root_element):
+    # Extract event details
+    summary = root_element.find('title').text if root_element.find('title') is not None else None
+    date = root_element.find('date').text if root_element.find('date') is not None else None
+    start_time = root_element.find('start_time').text if root_element.find('start_time') is not None else None
+    end_time = root_element.find('end_time').text if root_element.find('end_time') is not None else None
+    location = root_element.find('location').text if root_element.find('location') is not None else None
+    description = root_element.find('description').text if root_element.find('description') is not None else None
+    max_registrations = root_element.find('max_registrations').text if root_element.find('max_registrations') is not None else None
+    available_seats = root_element.find('available_seats').text if root_element.find('available_seats') is not None else None
+
+    # Ensure numeric values are properly converted
+    max_registrations = int(max_registrations) if max_registrations is not None else None
+    available_seats = int(available_seats) if available_seats is not None else None
+
+    # Compose start_datetime and end_datetime
+    start_datetime = None
+    end_datetime = None
+    if date and start_time:
+        start_datetime = datetime.strptime(f"{date} {start_time}", "%Y-%m-%d %H:%M:%S")
+    if date and end_time:
+        end_datetime = datetime.strptime(f"{date} {end_time}", "%Y-%m-%d %H:%M:%S")
+
+    return summary, start_datetime, end_datetime, location, description, max_registrations, available_seats
 
 def handle_event(root_element):
     try:
@@ -694,54 +709,76 @@ def handle_event(root_element):
         # Get the database connection
         conn = get_database_connection()
         if conn is None:
-            logger.error("Database connection failed. Unable to perform the operation.")
-            return
-        
-        cursor = conn.cursor()
+            raise RuntimeError("Database connection failed. Unable to perform the operation.")
 
-        if crud_operation == 'create':
-            # Extract event details
-            summary = root_element.find('title').text if root_element.find('title') is not None else None
-            date = root_element.find('date').text if root_element.find('date') is not None else None
-            start_time = root_element.find('start_time').text if root_element.find('start_time') is not None else None
-            end_time = root_element.find('end_time').text if root_element.find('end_time') is not None else None
-            location = root_element.find('location').text if root_element.find('location') is not None else None
-            description = root_element.find('description').text if root_element.find('description') is not None else None
-            max_registrations = root_element.find('max_registrations').text if root_element.find('max_registrations') is not None else None
-            available_seats = root_element.find('available_seats').text if root_element.find('available_seats') is not None else None
-
-            # Ensure numeric values are properly converted
-            max_registrations = int(max_registrations) if max_registrations is not None else None
-            available_seats = int(available_seats) if available_seats is not None else None
-
-            # Compose start_datetime and end_datetime
-            start_datetime = None
-            end_datetime = None
-            if date and start_time:
-                start_datetime = datetime.strptime(f"{date} {start_time}", "%Y-%m-%d %H:%M:%S")
-            if date and end_time:
-                end_datetime = datetime.strptime(f"{date} {end_time}", "%Y-%m-%d %H:%M:%S")
-            # Insert event data into the database
-            sql = """
-                INSERT INTO Events (summary, start_datetime, end_datetime, location, description, max_registrations, available_seats)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """
-            values = (summary, start_datetime, end_datetime, location, description, max_registrations, available_seats)
-            cursor.execute(sql, values)
-            conn.commit()
+        try:
+            cursor = conn.cursor()
+
+            if crud_operation == 'create':
+                summary, start_datetime, end_datetime, location, description, max_registrations, available_seats = parse_event_details(root_element)
+                # Insert event data into the database
+                sql = """
+                    INSERT INTO Events (summary, start_datetime, end_datetime, location, description, max_registrations, available_seats, MasterUuid)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                """
+                values = (summary, start_datetime, end_datetime, location, description, max_registrations, available_seats, uuid_keys.to_db(event_id))
+                cursor.execute(sql, values)
+                conn.commit()
+
+                cursor.execute("SELECT LAST_INSERT_ID()")
+                service_event_id = cursor.fetchone()[0]
+                logger.info("Event data successfully saved to database")
 
-            cursor.execute("SELECT LAST_INSERT_ID()")
-            service_event_id = cursor.fetchone()[0]
-            logger.info("Event data successfully saved to database")
+                master_uuid_client.add_service_id(event_id, 'planning', service_event_id)
 
-            add_service_id(event_id, 'planning', service_event_id)
+            else:
+                service_event_id = master_uuid_client.get_service_id(event_id, 'planning')
+                if service_event_id is None:
+                    # Nothing to update or delete, retrying won't change that
+                    logger.error(f"No planning event found for event ID '{event_id}'.")
+                    return
+
+                if crud_operation == 'update':
+                    summary, start_datetime, end_datetime, location, description, max_registrations, available_seats = parse_event_details(root_element)
+                    # Seats that are taken stay taken when the capacity changes, so Available_Seats moves
+                    # along with Max_Registrations instead of taking the value of the message.
+                    # MySQL assigns left to right: Available_Seats is computed from the old Max_Registrations.
+                    sql = """
+                        UPDATE Events
+                        SET Summary = %s, Start_datetime = %s, End_datetime = %s, Location = %s, Description = %s,
+                            Available_Seats = GREATEST(COALESCE(Available_Seats, 0) + COALESCE(%s, 0) - COALESCE(Max_Registrations, 0), 0),
+                            Max_Registrations = %s
+                        WHERE Id = %s
+                    """
+                    values = (summary, start_datetime, end_datetime, location, description, max_registrations, max_registrations, service_event_id)
+                    cursor.execute(sql, values)
+                    if cursor.rowcount == 0:
+                        # The event is gone (deleted or archived) or already has these details, no calendar work
+                        conn.rollback()
+                        logger.warning(f"Event '{event_id}' not updated, planning event {service_event_id} is missing or unchanged.")
+                        return
+                    calendar_worker.enqueue(cursor, 'update_event_attendees', event_id=service_event_id)
+                    conn.commit()
+                    logger.info(f"Event '{event_id}' updated, queued the update of the attendee calendars")
+
+                else:
+                    # The calendar mappings stay until the calendar worker has deleted the attendee events
+                    cursor.execute("DELETE FROM Attendance WHERE EventId = %s", (service_event_id,))
+                    cursor.execute("DELETE FROM Events WHERE Id = %s", (service_event_id,))
+                    calendar_worker.enqueue(cursor, 'delete_event_attendees', event_id=service_event_id)
+                    conn.commit()
+                    logger.info(f"Event '{event_id}' deleted, queued the delete from the attendee calendars")
+                    master_uuid_client.delete_service_id(event_id, 'planning')
 
-        # Close the cursor and connection
-        cursor.close()
-        conn.close()
+            # Close the cursor
+            cursor.close()
+        finally:
+            conn.close()
 
     except Exception as e:
         logger.error(f"Error saving event data to database: {str(e)}")
+        # The message goes to the retry queue and is tried again
+        raise
 
 #Function to extract attendance data and funtioncall to system
 def send_attendance_to_system(root_element):
@@ -749,75 +786,208 @@ def send_attendance_to_system(root_element):
         master_user_id = root_element.find('user_id').text
         master_event_id = root_element.find('event_id').text
 
-        user_id = get_service_id(master_user_id, 'planning')
-        event_id = get_service_id(master_event_id, 'planning')
+        user_id, event_id = master_uuid_client.get_service_ids([master_user_id, master_event_id], 'planning')
+        if user_id is None or event_id is None:
+            # The user or event may not have reached planning yet, the message is tried again later
+            raise LookupError(f"No planning ID for user {master_user_id} or event {master_event_id}")
 
         crud_operation = root_element.find('crud_operation').text
 
+        if crud_operation not in ('create', 'delete'):
+            log = f"Invalid CRUD operation: {crud_operation}"
+            logger.error(log)
+            publisher_planning.sendLogsToMonitoring("Invalid_operation", log, True)
+            return
+
+        conn = get_database_connection()
+        if conn is None:
+            raise RuntimeError("Database connection failed. Unable to process attendance.")
+
+        try:
+            cursor = conn.cursor()
+            attendance_key = (uuid_keys.to_db(user_id), event_id)
+            if crud_operation == 'create':
+                # A registration that is already recorded (a redelivered message) takes no second seat.
+                # Not INSERT IGNORE: that would also turn an invalid key into a stored row instead of an error.
+                cursor.execute(
+                    "INSERT INTO Attendance (UserId, EventId) VALUES (%s, %s) ON DUPLICATE KEY UPDATE EventId = EventId",
+                    attendance_key
+                )
+            else:
+                cursor.execute("DELETE FROM Attendance WHERE UserId = %s AND EventId = %s", attendance_key)
+            attendance_changed = cursor.rowcount == 1
+
+            if attendance_changed:
+                # Everything the event XML needs is read before the seat UPDATE locks the event row,
+                # the lock is then only held for the UPDATE and the outbox insert
+                event_data = publisher_planning.fetch_event_data(event_id, cursor)
+                speaker_ids = publisher_planning.get_user_and_company_ids(event_data[1], cursor) if event_data else (None, None)
+
+            if crud_operation == 'create':
+                # Take a seat first, a full event gets no calendar entry
+                if attendance_changed and not seat_reservations.reserve_seat(cursor, event_id):
+                    conn.rollback()
+                    log = f"Event {master_event_id} is full, registration of user {master_user_id} rejected."
+                    logger.warning(log)
+                    publisher_planning.sendLogsToMonitoring("Event_full", log, True)
+                    return
+                seats_changed = attendance_changed
+            else:
+                seats_changed = attendance_changed and seat_reservations.release_seat(cursor, event_id)
+
+            if seats_changed:
+                # Publish the new number of available seats in the same transaction as the seat change
+                cursor.execute("SELECT Available_Seats FROM Events WHERE Id = %s", (event_id,))
+                event_data = event_data[:-1] + cursor.fetchone()
+                publisher_planning.publish_event_xml(event_data, 'update', master_event_id, cursor, speaker_ids)
+
+            # Queue the calendar change for the calendar worker in the same transaction
+            if crud_operation == 'create':
+                calendar_worker.enqueue(cursor, 'add_event', user_id=user_id, event_id=event_id)
+            else:
+                calendar_worker.enqueue(cursor, 'delete_event', user_id=user_id, event_id=event_id)
+            conn.commit()
+            cursor.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
         if crud_operation == 'create':
-            # Call function to add event to calendar using extracted user_id and event_id
-            calendar_events.add_event_to_calendar(user_id, event_id)
-            logger.info("Event added to calendar successfully.")
-            log = "Event added to calendar successfully."
+            logger.info("Event queued to be added to calendar.")
+            log = "Event queued to be added to calendar."
             publisher_planning.sendLogsToMonitoring("Send_attendance", log, False)
 
-        elif crud_operation == 'delete':
-            # Call function to delete event from calendar using extracted user_id and event_id
-            calendar_events.delete_event_by_id(user_id, event_id)
-            logger.info("Event deleted from calendar successfully.")
-            log = "Event deleted from calendar successfully."
-            publisher_planning.sendLogsToMonitoring("Delete_attendance", log, False)
-
         else:
-            log = f"Invalid CRUD operation: {crud_operation}"
-            logger.error(log)
-            publisher_planning.sendLogsToMonitoring("Invalid_operation", log, True)
+            logger.info("Event queued to be deleted from calendar.")
+            log = "Event queued to be deleted from calendar."
+            publisher_planning.sendLogsToMonitoring("Delete_attendance", log, False)
 
     except Exception as e:
         error_message = f"Error processing attendance: {str(e)}"
         logger.error(error_message)
         publisher_planning.sendLogsToMonitoring("Error_processing_attendance", error_message, True)
-
-
-# Callback function for consuming messages
+        # The message goes to the retry queue and is tried again
+        raise
+
+
+# Function to validate a message body and hand it to the matching handler.
+# Handlers return normally for a message that is done or permanently invalid (it is acked)
+# and raise when it failed, so finish_message can retry it.
+def process_message(body):
+    xml_content = body.decode('utf-8')
+    is_valid, root_element = validate_xml(xml_content)
+    logger.debug(xml_content)
+
+    if is_valid:
+        xml_type = root_element.tag
+        logger.info(f"Received valid '{xml_type}' XML")
+
+        if xml_type == 'user':
+            save_user_to_database(root_element)
+        elif xml_type == 'company':
+            save_company_to_database(root_element)
+        elif xml_type == 'attendance':
+            send_attendance_to_system(root_element)
+        elif xml_type == 'event':
+            handle_event(root_element)
+        else:
+            logger.warning(f"No handler defined for XML type: {xml_type}")
+    else:
+        # An invalid message never becomes valid, it is acked and dropped
+        logger.error(f"Received invalid XML: {root_element}")
+
+# Function to declare the planning, retry and dead queues on a channel
+def declare_queues(channel):
+    channel.queue_declare(queue=QUEUE, durable=True)
+    channel.queue_declare(queue=RETRY_QUEUE, durable=True, arguments={
+        'x-message-ttl': CONSUMER_RETRY_DELAY * 1000,
+        'x-dead-letter-exchange': '',
+        'x-dead-letter-routing-key': QUEUE,
+    })
+    channel.queue_declare(queue=DEAD_QUEUE, durable=True)
+
+# Callback function for consuming messages (inline mode), handled on the connection thread
 def callback(ch, method, properties, body):
     try:
-        xml_content = body.decode('utf-8')
-        is_valid, root_element = validate_xml(xml_content)
-        logger.debug(xml_content)
-        
-        if is_valid:
-            xml_type = root_element.tag
-            print(f"Received valid '{xml_type}' XML:")
-            print(xml_content)
-            
-            if xml_type == 'user':
-                save_user_to_database(root_element)
-            elif xml_type == 'company':
-                save_company_to_database(root_element)
-            elif xml_type == 'attendance':
-                send_attendance_to_system(root_element)
-            elif xml_type == 'event':
-                handle_event(root_element)
-            else:
-                print(f"No handler defined for XML type: {xml_type}")
-        else:
-            print(f"Received invalid XML: {root_element}")
-    
+        process_message(body)
+        error = None
     except Exception as e:
-        print(f"Error processing message: {str(e)}")
-
-# Connect to RabbitMQ server
-credentials = pika.PlainCredentials(os.getenv('RABBITMQ_USER'), os.getenv('RABBITMQ_PASSWORD'))
-connection = pika.BlockingConnection(pika.ConnectionParameters(host=os.getenv('RABBITMQ_HOST'), credentials=credentials))
-channel = connection.channel()
-
-# Declare the queue
-channel.queue_declare(queue='planning', durable=True)
+        error = e
+    finish_message(ch, method.delivery_tag, properties, body, error)
+
+# Callback function for consuming messages (worker mode)
+# The message is handed to the worker pool; the ack is sent once the handler is done.
+def on_message(ch, method, properties, body, connection, executor):
+    future = executor.submit(process_message, body)
+    future.add_done_callback(
+        lambda f: connection.add_callback_threadsafe(
+            functools.partial(finish_message, ch, method.delivery_tag, properties, body, f.exception())
+        )
+    )
+
+# Function to ack a finished message, a failed one is first moved to the retry or dead queue.
+# Always runs on the connection thread.
+def finish_message(ch, delivery_tag, properties, body, error):
+    if not ch.is_open:
+        # The broker redelivers every unacked message of a closed channel
+        logger.warning(f"Channel closed before message {delivery_tag} could be acked")
+        return
+
+    if error is None:
+        ch.basic_ack(delivery_tag=delivery_tag)
+        return
+
+    headers = dict(properties.headers or {})
+    attempt = int(headers.get(ATTEMPT_HEADER, 1))
+    if attempt < CONSUMER_MAX_ATTEMPTS:
+        logger.error(f"Error processing message (attempt {attempt}), retrying in {CONSUMER_RETRY_DELAY}s: {error}")
+        metrics.increment('consumer.retried')
+        headers[ATTEMPT_HEADER] = attempt + 1
+        target = RETRY_QUEUE
+    else:
+        logger.error(f"Error processing message (attempt {attempt}), moved to {DEAD_QUEUE}: {error}")
+        metrics.increment('consumer.dead')
+        headers['x-error'] = str(error)[:1000]
+        target = DEAD_QUEUE
+
+    republish = pika.BasicProperties(content_type=properties.content_type, delivery_mode=2, headers=headers)
+    ch.basic_publish(exchange='', routing_key=target, body=body, properties=republish)
+    ch.basic_ack(delivery_tag=delivery_tag)
+
+def main():
+    # Connect to RabbitMQ server
+    credentials = pika.PlainCredentials(os.getenv('RABBITMQ_USER'), os.getenv('RABBITMQ_PASSWORD'))
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=os.getenv('RABBITMQ_HOST'), credentials=credentials))
+    channel = connection.channel()
+
+    # Declare the queues
+    declare_queues(channel)
+    # and the calendar task queues, so no task is published before they exist
+    calendar_worker.declare_queues(channel)
+
+    monitoring_shipper.start_metrics_reporter()
+
+    executor = None
+    if CONSUMER_WORKERS > 0:
+        # Worker mode: at most CONSUMER_PREFETCH unacked messages are handled by a pool of workers
+        channel.basic_qos(prefetch_count=CONSUMER_PREFETCH)
+        executor = ThreadPoolExecutor(max_workers=CONSUMER_WORKERS, thread_name_prefix='planning-worker')
+        on_message_callback = functools.partial(on_message, connection=connection, executor=executor)
+        channel.basic_consume(queue=QUEUE, on_message_callback=on_message_callback)
+    else:
+        # Inline mode: messages are handled one at a time on the connection thread
+        channel.basic_qos(prefetch_count=1)
+        channel.basic_consume(queue=QUEUE, on_message_callback=callback)
 
-# Set up consumer to receive messages from the queue
-channel.basic_consume(queue='planning', on_message_callback=callback, auto_ack=True)
+    # Start consuming messages
+    print('Waiting for messages...')
+    try:
+        channel.start_consuming()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
 
-# Start consuming messages
-print('Waiting for messages...')
-channel.start_consuming()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
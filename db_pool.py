@@ -0,0 +1,174 @@
+import os
+import sys
+import threading
+import time
+import logging
+import mysql.connector
+from mysql.connector import errors
+from dotenv import load_dotenv
+import metrics
+
+# Create a custom logger
+logger = logging.getLogger(__name__)
+
+# Set the level of this logger.
+logger.setLevel(logging.DEBUG)
+
+# Create handlers
+c_handler = logging.StreamHandler()
+s_handler = logging.StreamHandler(sys.stdout)
+c_handler.setLevel(logging.DEBUG)
+s_handler.setLevel(logging.DEBUG)
+
+# Create formatters and add it to handlers
+c_format = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+s_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+c_handler.setFormatter(c_format)
+s_handler.setFormatter(s_format)
+
+# Add handlers to the logger
+logger.addHandler(c_handler)
+logger.addHandler(s_handler)
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class PooledConnection:
+    # Wrapper around a MySQL connection that goes back to the pool on close()
+    # instead of being closed. Everything else is passed to the real connection.
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def close(self):
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            self._pool._release(connection)
+
+    def __getattr__(self, name):
+        if self._connection is None:
+            raise errors.OperationalError("Connection has already been returned to the pool")
+        return getattr(self._connection, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ConnectionPool:
+    # Bounded pool of MySQL connections shared by all threads of a process.
+    # Connections are created lazily, checked with a ping when they have been
+    # idle for longer than healthcheck_idle seconds, and a checkout waits up
+    # to checkout_timeout seconds when all connections are in use.
+
+    def __init__(self, size, checkout_timeout, healthcheck_idle, **connect_args):
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.healthcheck_idle = healthcheck_idle
+        self._connect_args = connect_args
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []  # (connection, last_used) pairs, most recently used last
+        self._in_use = 0
+
+    def get_connection(self, timeout=None):
+        timeout = self.checkout_timeout if timeout is None else timeout
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=timeout):
+            metrics.increment('db_pool.checkout_timeouts')
+            raise errors.PoolError(f"No MySQL connection available within {timeout} seconds")
+
+        try:
+            connection = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._update_gauges()
+        metrics.observe('db_pool.checkout_wait', time.perf_counter() - start)
+        return PooledConnection(self, connection)
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection, last_used = self._idle.pop()
+
+            if time.monotonic() - last_used < self.healthcheck_idle:
+                return connection
+            try:
+                connection.ping(reconnect=True, attempts=1, delay=0)
+                return connection
+            except errors.Error as e:
+                logger.warning(f"Discarding broken pooled MySQL connection: {e}")
+                metrics.increment('db_pool.discarded')
+                self._close_quietly(connection)
+
+        connection = mysql.connector.connect(**self._connect_args)
+        metrics.increment('db_pool.created')
+        return connection
+
+    def _release(self, connection):
+        try:
+            # Never hand out a connection with a half-finished transaction
+            if connection.in_transaction:
+                connection.rollback()
+            healthy = connection.is_connected()
+        except errors.Error:
+            healthy = False
+
+        with self._lock:
+            if healthy:
+                self._idle.append((connection, time.monotonic()))
+            self._in_use -= 1
+            self._update_gauges()
+        if not healthy:
+            metrics.increment('db_pool.discarded')
+            self._close_quietly(connection)
+        self._slots.release()
+
+    def _update_gauges(self):
+        metrics.set_gauge('db_pool.in_use', self._in_use)
+        metrics.set_gauge('db_pool.idle', len(self._idle))
+        metrics.set_gauge('db_pool.usage', self._in_use / self.size)
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except errors.Error:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# Function to get the process-wide connection pool, created on first use
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                size=int(os.getenv('DB_POOL_SIZE', 10)),
+                checkout_timeout=float(os.getenv('DB_POOL_TIMEOUT', 30)),
+                healthcheck_idle=float(os.getenv('DB_POOL_HEALTHCHECK_IDLE', 5)),
+                host=os.getenv('DB_HOST'),
+                port=os.getenv('DB_PORT', 3306),
+                user=os.getenv('DB_USER'),
+                password=os.getenv('DB_PASSWORD'),
+                database=os.getenv('DB_DATABASE')
+            )
+        return _pool
+
+
+# Function to check out a connection, call close() on it to give it back
+def get_connection(timeout=None):
+    return get_pool().get_connection(timeout)
@@ -0,0 +1,130 @@
+import os
+import sys
+import threading
+import time
+import logging
+import mysql.connector
+from dotenv import load_dotenv
+import db_pool
+import metrics
+
+# Create a custom logger
+logger = logging.getLogger(__name__)
+
+# Set the level of this logger.
+logger.setLevel(logging.DEBUG)
+
+# Create handlers
+c_handler = logging.StreamHandler()
+s_handler = logging.StreamHandler(sys.stdout)
+c_handler.setLevel(logging.DEBUG)
+s_handler.setLevel(logging.DEBUG)
+
+# Create formatters and add it to handlers
+c_format = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+s_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+c_handler.setFormatter(c_format)
+s_handler.setFormatter(s_format)
+
+# Add handlers to the logger
+logger.addHandler(c_handler)
+logger.addHandler(s_handler)
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Events stay in the hot Events table until they ended this many hours ago,
+# then they are moved to EventsArchive so the fetcher and calendar queries
+# only have to deal with current and upcoming events.
+ARCHIVE_AFTER_HOURS = int(os.getenv('EVENT_ARCHIVE_AFTER_HOURS', 24))
+
+# Seconds between two archival runs
+ARCHIVE_INTERVAL = float(os.getenv('EVENT_ARCHIVE_INTERVAL', 3600))
+
+# Number of events moved per transaction, keeps row locks short
+ARCHIVE_BATCH_SIZE = int(os.getenv('EVENT_ARCHIVE_BATCH_SIZE', 500))
+
+EVENT_COLUMNS = "Id, Speaker_email, Summary, Start_datetime, End_datetime, Location, Description, Max_Registrations, Available_Seats, GoogleEventId, MasterUuid"
+
+# Rows that belong to an event, moved along with it: (table, archive table, columns)
+EVENT_CHILD_TABLES = [
+    ('Attendance', 'AttendanceArchive', "UserId, EventId, CreatedAt"),
+    ('CalendarEventMappings', 'CalendarEventMappingsArchive', "UserId, EventId, CalendarId, GoogleEventId"),
+]
+
+
+# Function to move one batch of finished events to EventsArchive, together with their attendance and
+# calendar mappings so no rows are left pointing at a missing event. Returns the number of events moved.
+def archive_batch(mysql_connection):
+    cursor = mysql_connection.cursor()
+    try:
+        select_query = """
+            SELECT Id FROM Events
+            WHERE End_datetime < UTC_TIMESTAMP() - INTERVAL %s HOUR
+            ORDER BY End_datetime
+            LIMIT %s
+            FOR UPDATE
+        """
+        cursor.execute(select_query, (ARCHIVE_AFTER_HOURS, ARCHIVE_BATCH_SIZE))
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            mysql_connection.commit()
+            return 0
+
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(
+            f"INSERT INTO EventsArchive ({EVENT_COLUMNS}) SELECT {EVENT_COLUMNS} FROM Events WHERE Id IN ({placeholders})",
+            ids
+        )
+        for table, archive_table, columns in EVENT_CHILD_TABLES:
+            cursor.execute(
+                f"INSERT INTO {archive_table} ({columns}) SELECT {columns} FROM {table} WHERE EventId IN ({placeholders})",
+                ids
+            )
+            cursor.execute(f"DELETE FROM {table} WHERE EventId IN ({placeholders})", ids)
+        cursor.execute(f"DELETE FROM Events WHERE Id IN ({placeholders})", ids)
+        mysql_connection.commit()
+        return len(ids)
+    except mysql.connector.Error:
+        mysql_connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+# Function to archive every finished event
+def archive_events():
+    mysql_connection = db_pool.get_connection()
+    try:
+        total = 0
+        while True:
+            moved = archive_batch(mysql_connection)
+            total += moved
+            if moved < ARCHIVE_BATCH_SIZE:
+                break
+        if total:
+            logger.info("%d finished events moved to EventsArchive", total)
+        metrics.increment('events.archived', total)
+        return total
+    finally:
+        mysql_connection.close()
+
+
+def run_archiver():
+    while True:
+        try:
+            archive_events()
+        except Exception as e:
+            logger.error("Error archiving events: %s", e)
+        time.sleep(ARCHIVE_INTERVAL)
+
+
+# Function to run the archiver in a background thread of the calling process
+def start():
+    thread = threading.Thread(target=run_archiver, name='event-archiver', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    run_archiver()
@@ -2,12 +2,21 @@ import datetime
 import os
 import time
 import mysql.connector
+import db_pool
 import logging
 import publisher_planning
+import outbox
+import calendar_worker
+import uuid_keys
+import event_archiver
+import metrics
+import monitoring_shipper
+import adaptive_poller
+from concurrent.futures import ThreadPoolExecutor
 import sys
 from dotenv import load_dotenv
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
+import google_calendar_client
+from googleapiclient.errors import HttpError
 
 
 # Create a custom logger
@@ -39,94 +48,370 @@ logger.info('This is an info message')
 logger.warning('This is a warning')
 logger.error('This is an error')
 
-# If modifying these scopes, specify the required scopes for accessing Google Calendar.
-SCOPES = ['https://www.googleapis.com/auth/calendar']
-
 # Load environment variables from .env file
 load_dotenv()
 
 def connect_to_mysql():
     try:
-        # Connect to MySQL
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT', 3306),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_DATABASE')
-        )
+        # Check out a pooled MySQL connection
+        connection = db_pool.get_connection()
         logger.info("Connected to MySQL database")
         return connection
     except mysql.connector.Error as e:
         logger.error("Error connecting to MySQL: %s", e)
         return None
 
-def fetch_events(calendar_service, start_date, end_date, mysql_connection, interval_seconds=3):
-    try:
-        while True:
-            # Fetch events from Google Calendar
-            events_result = calendar_service.events().list(
-                calendarId="9ecbb3026111b91a9ce21bfed88d67b95783a5a418c6d82aaa220776eb70f5d3@group.calendar.google.com",
+# Calendars the fetcher ingests events from, comma separated.
+# An entry can set its own poll interval in seconds: "<calendar id>=<seconds>".
+CALENDARS = os.getenv(
+    'FETCHER_CALENDAR_IDS',
+    "9ecbb3026111b91a9ce21bfed88d67b95783a5a418c6d82aaa220776eb70f5d3@group.calendar.google.com"
+)
+
+# Default poll interval in seconds for calendars without one of their own.
+# This is the interval right after changes were seen, it backs off up to MAX_INTERVAL_SECONDS while nothing changes.
+INTERVAL_SECONDS = float(os.getenv('FETCHER_INTERVAL_SECONDS', 3))
+
+# Longest time in seconds between two polls of a calendar that doesn't change
+MAX_INTERVAL_SECONDS = float(os.getenv('FETCHER_MAX_INTERVAL_SECONDS', 300))
+
+# Maximum number of calendars synced at the same time
+WORKERS = int(os.getenv('FETCHER_WORKERS', 4))
+
+# Function to parse CALENDARS into (calendar_id, interval_seconds) pairs
+def parse_calendars(value):
+    calendars = []
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        calendar_id, _, interval = entry.partition('=')
+        calendars.append((calendar_id.strip(), float(interval) if interval else INTERVAL_SECONDS))
+    return calendars
+
+# Calendar events are added to by add_event_to_google_calendar
+CALENDAR_ID = parse_calendars(CALENDARS)[0][0]
+
+# Only fetch events that changed since the last poll (Calendar API syncToken) instead of listing the whole window
+INCREMENTAL_SYNC = os.getenv('FETCHER_INCREMENTAL_SYNC', 'true').lower() == 'true'
+
+# How far ahead of now events are ingested
+WINDOW = datetime.timedelta(weeks=int(os.getenv('FETCHER_WINDOW_WEEKS', 3)))
+
+# How far the window end may fall behind before the newly covered range is listed
+WINDOW_STEP = datetime.timedelta(minutes=int(os.getenv('FETCHER_WINDOW_STEP_MINUTES', 60)))
+
+# Number of calendar events diffed against the Events table per query
+PAGE_SIZE = int(os.getenv('FETCHER_PAGE_SIZE', 250))
+
+# Function to turn a Google date or dateTime string into a naive UTC datetime
+def to_utc(value):
+    parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+# Function to extract the Events columns from a Google Calendar event
+def parse_event(event):
+    summary = event['summary']
+    start = to_utc(event['start'].get('dateTime', event['start'].get('date')))
+    end = to_utc(event['end'].get('dateTime', event['end'].get('date')))
+    location_with_max = event.get('location', 'N/A')
+    attendees = event.get('attendees', [])
+    speaker_email = attendees[0]['email'] if attendees else 'N/A'  # Assuming first attendee is the speaker
+    # Split location to extract location and max_registrations
+    location_parts = location_with_max.split('-')
+    location = location_parts[0].strip() if len(location_parts) >= 1 else 'N/A'  # Extract location
+    max_registrations = int(location_parts[1]) if len(location_parts) >= 2 else 0  # Extract max_registrations
+    description = event.get('description', 'N/A')
+    return speaker_email, summary, start, end, location, description, max_registrations
+
+# Function to list events, following every page.
+# With a sync token only the events changed since that token are returned (cancelled ones included).
+# Returns the events and the sync token for the next poll.
+def list_events(calendar_service, calendar_id, start_date, end_date, sync_token=None):
+    events = []
+    page_token = None
+    while True:
+        if sync_token:
+            request = calendar_service.events().list(
+                calendarId=calendar_id,
+                syncToken=sync_token,
+                singleEvents=True,
+                pageToken=page_token,
+            )
+        else:
+            request = calendar_service.events().list(
+                calendarId=calendar_id,
                 timeMin=start_date.isoformat() + 'Z',
                 timeMax=end_date.isoformat() + 'Z',
                 singleEvents=True,
-            ).execute()
-
-            events = events_result.get('items', [])
-
-            if events:
-                try:
-                    cursor = mysql_connection.cursor()
-                    insert_query = "INSERT INTO Events (speaker_email, summary, start_datetime, end_datetime, location, description, max_registrations, available_seats) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
-                    for event in events:
-                        summary = event['summary']
-                        start = event['start'].get('dateTime', event['start'].get('date'))
-                        end = event['end'].get('dateTime', event['end'].get('date'))
-                        location_with_max = event.get('location', 'N/A')
-                        attendees = event.get('attendees', [])
-                        speaker_email = attendees[0]['email'] if attendees else 'N/A'  # Assuming first attendee is the speaker
-                        # Split location to extract location and max_registrations
-                        location_parts = location_with_max.split('-')
-                        location = location_parts[0].strip() if len(location_parts) >= 1 else 'N/A'  # Extract location
-                        max_registrations = int(location_parts[1]) if len(location_parts) >= 2 else 0  # Extract max_registrations
-                        description = event.get('description', 'N/A')
-                        available_seats = max_registrations
-                        # Check if event already exists in the database
-                        event_exists_query = "SELECT COUNT(*) FROM Events WHERE summary = %s AND start_datetime = %s AND end_datetime = %s"
-                        cursor.execute(event_exists_query, (summary, start, end))
-                        event_count = cursor.fetchone()[0]
-
-                        if event_count == 0:
-                            # Insert event into MySQL table if it doesn't exist
-                            cursor.execute(insert_query, (speaker_email, summary, start, end, location, description, max_registrations, available_seats))
-                            retrieve_event_id_query = "SELECT id, speaker_email, summary, start_datetime, end_datetime, location, description, max_registrations, available_seats FROM Events WHERE summary = %s"
-                            # Check if the event exists in the MySQL table
-                            cursor.execute(retrieve_event_id_query, (summary,))
-                            result = cursor.fetchone()
-                            if result:
-                                logs = "Event inserted into MySQL table: %s" % summary
-                                logger.info("Event inserted into MySQL table: %s", summary)
-                                publisher_planning.sendLogsToMonitoring("Create-Event", logs, False)
-                                publisher_planning.publish_event_xml(result)
-                            else:
-                                logger.error("Failed to retrieve event ID for inserted event: %s", summary)
-                        #else:
-                            # logger.info("Event already exists in MySQL table. Skipping insertion: %s", summary)
-
-                    mysql_connection.commit()
-                    logger.info("Events inserted into MySQL table")
-                except mysql.connector.Error as e:
-                    logger.error("Error inserting events into MySQL table: %s", e)
-                    mysql_connection.rollback()
-                finally:
-                    cursor.close()
-            else:
-                logger.info("No events found in the calendar within the specified time range.")
-
-            time.sleep(interval_seconds)  # Sleep for specified interval before checking again
+                pageToken=page_token,
+            )
+        events_result = google_calendar_client.execute(request, 'events.list', calendar_id)
+        events.extend(events_result.get('items', []))
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            return events, events_result.get('nextSyncToken')
+
+# Function to load the persisted fetch cursor of a calendar: its sync token and the window already listed
+def load_cursor(mysql_connection, calendar_id):
+    cursor = mysql_connection.cursor()
+    cursor.execute("SELECT SyncToken, WindowStart, WindowEnd FROM CalendarSyncState WHERE CalendarId = %s", (calendar_id,))
+    result = cursor.fetchone()
+    cursor.close()
+    mysql_connection.commit()
+    sync_token, window_start, window_end = result if result else (None, None, None)
+    return {'calendar_id': calendar_id, 'sync_token': sync_token, 'window_start': window_start, 'window_end': window_end}
+
+def save_cursor(cursor, state):
+    query = """
+        INSERT INTO CalendarSyncState (CalendarId, SyncToken, WindowStart, WindowEnd, UpdatedAt)
+        VALUES (%s, %s, %s, %s, UTC_TIMESTAMP())
+        ON DUPLICATE KEY UPDATE SyncToken = VALUES(SyncToken), WindowStart = VALUES(WindowStart),
+            WindowEnd = VALUES(WindowEnd), UpdatedAt = VALUES(UpdatedAt)
+    """
+    cursor.execute(query, (state['calendar_id'], state['sync_token'], state['window_start'], state['window_end']))
+
+# Function to hand changed or cancelled events on, in the transaction of the cursor: the update or delete
+# XML goes into the outbox and the attendee calendars are updated by the calendar worker, the same as
+# consumer_planning2.handle_event does. Runs after an update and before a delete, the rows must exist.
+def publish_changes(cursor, event_ids, crud_operation):
+    task = 'update_event_attendees' if crud_operation == 'update' else 'delete_event_attendees'
+    for event_id in event_ids:
+        # A locking read sees the latest master UUID, not the one of the transaction's snapshot
+        cursor.execute("SELECT MasterUuid FROM Events WHERE Id = %s FOR UPDATE", (event_id,))
+        master_event_id = uuid_keys.from_db(cursor.fetchone()[0])
+        if master_event_id is not None:
+            # Without one the create message is still in the outbox, it is rendered from the current row
+            publisher_planning.publish_event_xml(publisher_planning.fetch_event_data(event_id, cursor), crud_operation, master_event_id, cursor)
+        calendar_worker.enqueue(cursor, task, event_id=event_id)
+
+# Function to apply a page of Google Calendar events to the Events table with a fixed number of queries:
+# one delete for the cancelled events, one lookup of the existing rows, an update per changed row,
+# one multi-row insert for the new ones and one lookup of their ids. Changed and cancelled events
+# are handed on with publish_changes.
+# Returns (inserted rows, in the column order of publisher_planning.fetch_event_data, number of rows
+# inserted, updated or deleted). Listed events that were already up to date are not counted.
+def apply_events(cursor, events, start_date, end_date, apply_updates=True):
+    changes = 0
+    cancelled_ids = [event['id'] for event in events if event.get('status') == 'cancelled']
+    if cancelled_ids:
+        placeholders = ', '.join(['%s'] * len(cancelled_ids))
+        cursor.execute(f"SELECT Id FROM Events WHERE GoogleEventId IN ({placeholders}) FOR UPDATE", cancelled_ids)
+        deleted_ids = [row[0] for row in cursor.fetchall()]
+        if deleted_ids:
+            publish_changes(cursor, deleted_ids, 'delete')
+            placeholders = ', '.join(['%s'] * len(deleted_ids))
+            # The calendar mappings stay until the calendar worker has deleted the attendee events
+            cursor.execute(f"DELETE FROM Attendance WHERE EventId IN ({placeholders})", deleted_ids)
+            cursor.execute(f"DELETE FROM Events WHERE Id IN ({placeholders})", deleted_ids)
+            logger.info("%d cancelled events deleted from MySQL table", len(deleted_ids))
+            changes += len(deleted_ids)
+
+    parsed = {event['id']: parse_event(event) for event in events if event.get('status') != 'cancelled'}
+    if not parsed:
+        return [], changes
+
+    # Find the rows that already exist, rows inserted before GoogleEventId existed are matched on summary and times
+    google_ids = list(parsed)
+    summaries = list({values[1] for values in parsed.values()})
+    query = f"""
+        SELECT Id, GoogleEventId, Summary, Start_datetime, End_datetime FROM Events
+        WHERE GoogleEventId IN ({', '.join(['%s'] * len(google_ids))})
+           OR (GoogleEventId IS NULL AND Summary IN ({', '.join(['%s'] * len(summaries))}) AND End_datetime >= %s)
+    """
+    cursor.execute(query, google_ids + summaries + [start_date])
+    existing_by_google_id = {}
+    legacy_rows = {}
+    for row_id, google_event_id, summary, start, end in cursor.fetchall():
+        if google_event_id is not None:
+            existing_by_google_id[google_event_id] = row_id
+        else:
+            legacy_rows[(summary, start, end)] = row_id
+
+    updates = []
+    inserts = []
+    for google_event_id, values in parsed.items():
+        speaker_email, summary, start, end, location, description, max_registrations = values
+        row_id = existing_by_google_id.get(google_event_id)
+        if row_id is None:
+            row_id = legacy_rows.pop((summary, start, end), None)
+            if row_id is not None:
+                # Always store the Google event ID on legacy rows so they are found by ID from now on
+                updates.append((row_id, google_event_id) + values)
+                continue
+        elif apply_updates:
+            updates.append((row_id, google_event_id) + values)
+            continue
+
+        # Incremental syncs report changes anywhere on the calendar, only ingest new events inside the window
+        if row_id is None and end >= start_date and start <= end_date:
+            inserts.append((google_event_id,) + values + (max_registrations,))
+
+    if updates:
+        # A plain UPDATE: a row that was archived or deleted in the meantime stays gone.
+        # Keep the seats that are already taken when max_registrations changes, MySQL assigns
+        # left to right so available_seats is computed from the old max_registrations.
+        update_query = """
+            UPDATE Events
+            SET available_seats = GREATEST(COALESCE(available_seats, 0) + COALESCE(%s, 0) - COALESCE(max_registrations, 0), 0),
+                max_registrations = %s,
+                GoogleEventId = %s, speaker_email = %s, summary = %s,
+                start_datetime = %s, end_datetime = %s, location = %s, description = %s
+            WHERE Id = %s
+        """
+        # One statement per row (executemany does the same for an UPDATE), so the rows that changed are known
+        changed_ids = []
+        for row_id, google_event_id, speaker_email, summary, start, end, location, description, max_registrations in updates:
+            cursor.execute(update_query, (max_registrations, max_registrations, google_event_id, speaker_email, summary, start, end, location, description, row_id))
+            if cursor.rowcount:
+                changed_ids.append(row_id)
+        publish_changes(cursor, changed_ids, 'update')
+        changes += len(changed_ids)
+
+    if not inserts:
+        return [], changes
+
+    # executemany sends the rows as one multi-row INSERT
+    insert_query = "INSERT INTO Events (GoogleEventId, speaker_email, summary, start_datetime, end_datetime, location, description, max_registrations, available_seats) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"
+    cursor.executemany(insert_query, inserts)
+
+    # Read the new ids back by GoogleEventId (unique). With innodb_autoinc_lock_mode=2 and other
+    # inserters running, the ids of one multi-row insert are not guaranteed to be consecutive.
+    inserted_ids = [row[0] for row in inserts]
+    cursor.execute(
+        f"SELECT GoogleEventId, Id FROM Events WHERE GoogleEventId IN ({', '.join(['%s'] * len(inserted_ids))})",
+        inserted_ids
+    )
+    ids = dict(cursor.fetchall())
+    return [(ids[row[0]],) + row[1:] for row in inserts], changes + len(inserts)
 
+# Function to bring the Events table up to date with one calendar, returns the number of changed rows.
+# A poll that changed nothing returns 0 even when it listed events, so the poller can back off.
+# The window [now, now + WINDOW] slides with the clock; state is the calendar's fetch cursor (see load_cursor).
+def sync_calendar(calendar_service, mysql_connection, state):
+    calendar_id = state['calendar_id']
+    start_date = datetime.datetime.utcnow()
+    end_date = start_date + WINDOW
+    sync_token = state['sync_token'] if INCREMENTAL_SYNC else None
+
+    # Fetch new, changed and cancelled events from Google Calendar
+    try:
+        events, next_sync_token = list_events(calendar_service, calendar_id, start_date, end_date, sync_token)
+    except HttpError as e:
+        if e.resp.status != 410 or not sync_token:
+            raise
+        # The sync token has expired, start over with a full sync
+        logger.warning("Sync token expired for calendar %s, doing a full resync", calendar_id)
+        sync_token = None
+        events, next_sync_token = list_events(calendar_service, calendar_id, start_date, end_date)
+
+    window_end = state['window_end']
+    if not sync_token:
+        # A full listing covers the whole window
+        window_end = end_date
+    elif window_end is None or end_date - window_end >= WINDOW_STEP:
+        # Events that slid into the window without changing are not reported by the sync token
+        entering, _ = list_events(calendar_service, calendar_id, window_end or start_date, end_date)
+        changed_ids = {event['id'] for event in events}
+        events.extend(event for event in entering if event['id'] not in changed_ids)
+        window_end = end_date
+
+    if not INCREMENTAL_SYNC:
+        next_sync_token = None
+
+    if not events and next_sync_token == state['sync_token'] and window_end == state['window_end']:
+        logger.info("No changed events found in calendar %s.", calendar_id)
+        return 0
+
+    cursor = mysql_connection.cursor()
+    try:
+        inserted = []
+        changes = 0
+        for page_start in range(0, len(events), PAGE_SIZE):
+            page = events[page_start:page_start + PAGE_SIZE]
+            page_inserted, page_changes = apply_events(cursor, page, start_date, end_date, apply_updates=INCREMENTAL_SYNC)
+            inserted.extend(page_inserted)
+            changes += page_changes
+
+        # The event XML goes into the outbox in the same transaction as the new events. It needs a
+        # master UUID first, so it is a pending message rendered by the outbox relay.
+        for result in inserted:
+            outbox.enqueue(cursor, 'event', result[0], 'amq.topic', 'event.planning', None)
+
+        # Store the cursor in the same transaction as the changes it covers
+        new_state = dict(state, sync_token=next_sync_token, window_start=start_date, window_end=window_end)
+        save_cursor(cursor, new_state)
+        mysql_connection.commit()
+        state.update(new_state)
+    except mysql.connector.Error as e:
+        logger.error("Error inserting events into MySQL table: %s", e)
+        mysql_connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    for result in inserted:
+        summary = result[2]
+        logs = "Event inserted into MySQL table: %s" % summary
+        logger.info("Event inserted into MySQL table: %s", summary)
+        publisher_planning.sendLogsToMonitoring("Create-Event", logs, False)
+    logger.info("%d events listed, %d rows changed in MySQL table", len(events), changes)
+    return changes
+
+# Function to run one poll of a calendar on a worker thread, errors stay isolated to that calendar
+def poll_calendar(schedule):
+    calendar_id = schedule['calendar_id']
+    poller = schedule['poller']
+    try:
+        mysql_connection = db_pool.get_connection()
+        try:
+            if schedule['state'] is None:
+                # Resume from the persisted cursor, after a restart only the changes since then are fetched
+                schedule['state'] = load_cursor(mysql_connection, calendar_id)
+            changes = sync_calendar(google_calendar_client.get_service(), mysql_connection, schedule['state'])
+            schedule['last_success'] = time.monotonic()
+        finally:
+            mysql_connection.close()
+        delay = poller.next_delay(changes)
     except Exception as e:
-        logger.error("An error occurred: %s", e)
+        throttled = google_calendar_client.is_rate_limited(e)
+        if throttled:
+            logger.warning("Calendar %s is rate limited, backing off", calendar_id)
+            metrics.increment(f"fetcher.throttled.{calendar_id}")
+        else:
+            logger.error("Error syncing calendar %s: %s", calendar_id, e)
+            metrics.increment(f"fetcher.errors.{calendar_id}")
+        delay = poller.next_delay(throttled=True, retry_after=google_calendar_client.retry_after_seconds(e))
+
+    metrics.set_gauge(f"fetcher.interval.{calendar_id}", delay)
+    schedule['next_run'] = time.monotonic() + delay
+
+# Function to poll every calendar on its own adaptive interval with a bounded pool of workers.
+# A calendar is never polled twice at the same time, and a slow or failing one doesn't hold up the others.
+def run_fetcher(calendars, workers=WORKERS):
+    started_at = time.monotonic()
+    schedules = [
+        {'calendar_id': calendar_id, 'next_run': started_at, 'last_success': None, 'state': None, 'future': None,
+         'poller': adaptive_poller.AdaptivePoller(min_interval=interval, max_interval=MAX_INTERVAL_SECONDS)}
+        for calendar_id, interval in calendars
+    ]
+    logger.info("Fetching events from %d calendars with %d workers", len(schedules), workers)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='calendar-fetcher') as executor:
+        while True:
+            now = time.monotonic()
+            for schedule in schedules:
+                # Seconds since the calendar was last synced successfully
+                last_success = schedule['last_success'] or started_at
+                metrics.set_gauge(f"fetcher.lag.{schedule['calendar_id']}", now - last_success)
+
+                future = schedule['future']
+                if (future is None or future.done()) and now >= schedule['next_run']:
+                    schedule['next_run'] = float('inf')
+                    schedule['future'] = executor.submit(poll_calendar, schedule)
+            time.sleep(0.1)
 
 def fetch_event_by_id(event_id, mysql_connection):
     try:
@@ -144,32 +429,15 @@ def fetch_event_by_id(event_id, mysql_connection):
         logger.error("Error fetching event from MySQL: %s", e)
         return None
 
-def add_event_to_google_calendar(event_id):
+def add_event_to_google_calendar(event_id, calendar_id=CALENDAR_ID):
      
-    creds = service_account.Credentials.from_service_account_info(
-        {
-            "type": "service_account",
-            "project_id": os.getenv("PROJECT_ID"),
-            "private_key_id": os.getenv("PRIVATE_KEY_ID"),
-            "private_key": os.getenv("PRIVATE_KEY").replace("\\n", "\n"),
-            "client_email": os.getenv("CLIENT_EMAIL"),
-            "client_id": os.getenv("CLIENT_ID"),
-            "auth_uri": os.getenv("AUTH_URI"),
-            "token_uri": os.getenv("TOKEN_URI"),
-            "auth_provider_x509_cert_url": os.getenv("AUTH_PROVIDER_X509_CERT_URL"),
-            "client_x509_cert_url": os.getenv("CLIENT_X509_CERT_URL"),
-            "universe_domain": os.getenv("UNIVERSE_DOMAIN")
-        },
-        scopes=SCOPES
-    )
-
-    service = build('calendar', 'v3', credentials=creds)
-    calendar_id = "9ecbb3026111b91a9ce21bfed88d67b95783a5a418c6d82aaa220776eb70f5d3@group.calendar.google.com"
+    service = google_calendar_client.get_service()
     # Connect to MySQL
     mysql_connection = connect_to_mysql()
     if mysql_connection is None:
         exit()
     event = fetch_event_by_id(event_id, mysql_connection)
+    mysql_connection.close()
     if not event:
         logger.error("Event with ID %s not found in the database", event_id)
         return
@@ -192,40 +460,17 @@ def add_event_to_google_calendar(event_id):
     }
 
     try:
-        service.events().insert(calendarId=calendar_id, body=google_event).execute()
+        google_calendar_client.execute(service.events().insert(calendarId=calendar_id, body=google_event), 'events.insert', calendar_id)
         logger.info('Event created')
     except Exception as e:
         logger.error("Error adding event to Google Calendar: %s", e)
 
 
 if __name__ == "__main__":
-    # Set start date to today and end date to 3 weeks after
-    start_date = datetime.datetime.now()
-    end_date = datetime.datetime.now() + datetime.timedelta(weeks=3)
-
-   
-    creds = service_account.Credentials.from_service_account_info(
-        {
-            "type": "service_account",
-            "project_id": os.getenv("PROJECT_ID"),
-            "private_key_id": os.getenv("PRIVATE_KEY_ID"),
-            "private_key": os.getenv("PRIVATE_KEY").replace("\\n", "\n"),
-            "client_email": os.getenv("CLIENT_EMAIL"),
-            "client_id": os.getenv("CLIENT_ID"),
-            "auth_uri": os.getenv("AUTH_URI"),
-            "token_uri": os.getenv("TOKEN_URI"),
-            "auth_provider_x509_cert_url": os.getenv("AUTH_PROVIDER_X509_CERT_URL"),
-            "client_x509_cert_url": os.getenv("CLIENT_X509_CERT_URL"),
-            "universe_domain": os.getenv("UNIVERSE_DOMAIN")
-        },
-        scopes=SCOPES
-    )
+    # Move finished events out of the hot Events table in the background
+    event_archiver.start()
+    # Send the fetcher metrics (lag, intervals, ...) to monitoring in the background
+    monitoring_shipper.start_metrics_reporter()
 
-    service = build('calendar', 'v3', credentials=creds)
-
-    # Connect to MySQL
-    mysql_connection = connect_to_mysql()
-    if mysql_connection is None:
-        exit()
     # Fetch events
-    fetch_events(service, start_date, end_date, mysql_connection)
+    run_fetcher(parse_calendars(CALENDARS))
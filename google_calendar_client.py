@@ -0,0 +1,302 @@
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import logging
+import httplib2
+import google_auth_httplib2
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient import discovery_cache
+from googleapiclient.errors import HttpError
+from dotenv import load_dotenv
+import metrics
+import token_bucket
+
+# Create a custom logger
+logger = logging.getLogger(__name__)
+
+# Set the level of this logger.
+logger.setLevel(logging.DEBUG)
+
+# Create handlers
+c_handler = logging.StreamHandler()
+s_handler = logging.StreamHandler(sys.stdout)
+c_handler.setLevel(logging.DEBUG)
+s_handler.setLevel(logging.DEBUG)
+
+# Create formatters and add it to handlers
+c_format = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+s_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+c_handler.setFormatter(c_format)
+s_handler.setFormatter(s_format)
+
+# Add handlers to the logger
+logger.addHandler(c_handler)
+logger.addHandler(s_handler)
+
+# Load environment variables from .env file
+load_dotenv()
+
+# If modifying these scopes, specify the required scopes for accessing Google Calendar.
+SCOPES = ['https://www.googleapis.com/auth/calendar']
+
+# Socket timeout in seconds for calls to the Calendar API
+HTTP_TIMEOUT = float(os.getenv('GOOGLE_HTTP_TIMEOUT', 30))
+
+# Client-side rate limits in calls per second, shared by every thread of the process.
+# The project limit covers all calls, the calendar limit every single calendar
+# (Google enforces per-calendar write limits too). 0 disables a limit.
+PROJECT_RATE = float(os.getenv('GOOGLE_PROJECT_RATE', 10))
+PROJECT_BURST = int(os.getenv('GOOGLE_PROJECT_BURST', 20))
+CALENDAR_RATE = float(os.getenv('GOOGLE_CALENDAR_RATE', 2))
+CALENDAR_BURST = int(os.getenv('GOOGLE_CALENDAR_BURST', 5))
+
+# Retries of rate limited, 5xx and connection errors, with exponential backoff and full jitter
+MAX_RETRIES = int(os.getenv('GOOGLE_MAX_RETRIES', 5))
+RETRY_BASE_DELAY = float(os.getenv('GOOGLE_RETRY_BASE_DELAY', 1))
+RETRY_MAX_DELAY = float(os.getenv('GOOGLE_RETRY_MAX_DELAY', 32))
+
+RETRYABLE_STATUSES = {500, 502, 503, 504}
+
+# A Calendar API batch request holds at most 50 calls
+BATCH_LIMIT = 50
+BATCH_SIZE = max(1, min(int(os.getenv('GOOGLE_BATCH_SIZE', BATCH_LIMIT)), BATCH_LIMIT))
+
+# Credentials and the discovery document are shared by the whole process.
+# httplib2 is not thread-safe, so every thread gets its own service object.
+_credentials = None
+_discovery_doc = None
+_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_local = threading.local()
+_project_bucket = token_bucket.TokenBucket(PROJECT_RATE, PROJECT_BURST) if PROJECT_RATE > 0 else None
+_calendar_buckets = {}
+
+
+# Function to build the service account credentials once from the environment
+def get_credentials():
+    global _credentials
+    with _lock:
+        if _credentials is None:
+            _credentials = service_account.Credentials.from_service_account_info(
+                {
+                    "type": "service_account",
+                    "project_id": os.getenv("PROJECT_ID"),
+                    "private_key_id": os.getenv("PRIVATE_KEY_ID"),
+                    "private_key": os.getenv("PRIVATE_KEY").replace("\\n", "\n"),
+                    "client_email": os.getenv("CLIENT_EMAIL"),
+                    "client_id": os.getenv("CLIENT_ID"),
+                    "auth_uri": os.getenv("AUTH_URI"),
+                    "token_uri": os.getenv("TOKEN_URI"),
+                    "auth_provider_x509_cert_url": os.getenv("AUTH_PROVIDER_X509_CERT_URL"),
+                    "client_x509_cert_url": os.getenv("CLIENT_X509_CERT_URL"),
+                    "universe_domain": os.getenv("UNIVERSE_DOMAIN")
+                },
+                scopes=SCOPES
+            )
+        return _credentials
+
+
+# Function to make sure the shared access token is valid, only refreshed when it has expired
+def ensure_token():
+    creds = get_credentials()
+    if creds.valid:
+        return
+    with _refresh_lock:
+        # Another thread may have refreshed it while we were waiting
+        if creds.valid:
+            return
+        start = time.perf_counter()
+        creds.refresh(Request())
+        metrics.observe('google_calendar.token_refresh', time.perf_counter() - start)
+        logger.info("Google access token refreshed")
+
+
+def _get_discovery_doc():
+    global _discovery_doc
+    with _lock:
+        if _discovery_doc is None:
+            _discovery_doc = discovery_cache.get_static_doc('calendar', 'v3')
+        return _discovery_doc
+
+
+# Function to get the Calendar service object of the current thread
+def get_service():
+    service = getattr(_local, 'service', None)
+    if service is None:
+        http = google_auth_httplib2.AuthorizedHttp(get_credentials(), http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        discovery_doc = _get_discovery_doc()
+        if discovery_doc is not None:
+            service = build_from_document(discovery_doc, http=http)
+        else:
+            service = build('calendar', 'v3', http=http)
+        _local.service = service
+    return service
+
+
+def _get_calendar_bucket(calendar_id):
+    if CALENDAR_RATE <= 0 or calendar_id is None:
+        return None
+    with _lock:
+        bucket = _calendar_buckets.get(calendar_id)
+        if bucket is None:
+            bucket = token_bucket.TokenBucket(CALENDAR_RATE, CALENDAR_BURST)
+            _calendar_buckets[calendar_id] = bucket
+        return bucket
+
+
+# Function to wait until the project and calendar rate limits allow another call
+def throttle(calendar_id=None):
+    waited = 0.0
+    for bucket in (_project_bucket, _get_calendar_bucket(calendar_id)):
+        if bucket is not None:
+            waited += bucket.acquire()
+    if waited:
+        metrics.increment('google_calendar.throttled')
+        metrics.observe('google_calendar.throttle_wait', waited)
+
+
+# Function to tell whether a failed call may succeed when it is tried again.
+# A 5xx or a timeout may come after Google applied the call, so a call that is not
+# idempotent (e.g. calendars.insert) is only retried when it was rate limited.
+def is_retryable(error, idempotent=True):
+    if is_rate_limited(error):
+        return True
+    if not idempotent:
+        return False
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES
+    return isinstance(error, (socket.timeout, ConnectionError))
+
+
+# Function to get the backoff before retry number attempt (starting at 0) of a failed call
+def backoff_delay(attempt, error=None):
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+# Function to execute a Calendar API request, every call to Google goes through here.
+# It waits for the rate limits, retries retryable errors and records how long the call took.
+# Pass idempotent=False for a call that must not be sent twice, see is_retryable.
+def execute(request, name, calendar_id=None, idempotent=True):
+    attempt = 0
+    while True:
+        throttle(calendar_id)
+        ensure_token()
+        try:
+            with metrics.timed(f"google_calendar.{name}"):
+                return request.execute()
+        except Exception as e:
+            if not is_retryable(e, idempotent) or attempt >= MAX_RETRIES:
+                metrics.increment('google_calendar.failed')
+                metrics.increment(f"google_calendar.failed.{name}")
+                raise
+            if is_rate_limited(e):
+                metrics.increment('google_calendar.rate_limited')
+            delay = backoff_delay(attempt, e)
+            logger.warning("Google Calendar %s failed (%s), retry %d in %.1fs", name, e, attempt + 1, delay)
+            metrics.increment('google_calendar.retried')
+            time.sleep(delay)
+            attempt += 1
+
+
+# Function to tell whether an HttpError is Google asking us to slow down
+def is_rate_limited(error):
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    if error.resp.status == 403:
+        try:
+            reasons = {detail.get('reason') for detail in json.loads(error.content)['error'].get('errors', [])}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return False
+        return bool(reasons & {'rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded'})
+    return False
+
+
+# Function to read the Retry-After header (in seconds) of an HttpError, None when there is none
+def retry_after_seconds(error):
+    value = error.resp.get('retry-after') if isinstance(error, HttpError) else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+# Function to send one batch request, stores finished calls in results and returns the calls to retry
+def _execute_chunk(service, chunk, name, results, idempotent):
+    responses = {}
+
+    def callback(request_id, response, exception):
+        responses[request_id] = (response, exception)
+
+    batch = service.new_batch_http_request(callback=callback)
+    for index, (key, request, calendar_id) in enumerate(chunk):
+        # Every call in a batch counts against the quota on its own
+        throttle(calendar_id)
+        batch.add(request, request_id=str(index))
+    ensure_token()
+    try:
+        with metrics.timed(f"google_calendar.batch.{name}"):
+            batch.execute()
+    except Exception as e:
+        # The batch request itself failed, none of its calls got an answer
+        responses = {str(index): (None, e) for index in range(len(chunk))}
+
+    retry = []
+    for index, (key, request, calendar_id) in enumerate(chunk):
+        if str(index) in responses:
+            response, error = responses[str(index)]
+        else:
+            # No answer to this call at all, it may or may not have been applied
+            response, error = None, ConnectionError(f"No response to call {index} of Google Calendar batch {name}")
+        if error is not None and is_retryable(error, idempotent):
+            retry.append((key, request, calendar_id, error))
+        else:
+            results[key] = (response, error)
+            if error is not None:
+                metrics.increment('google_calendar.failed')
+                metrics.increment(f"google_calendar.failed.{name}")
+    return retry
+
+
+# Function to execute many Calendar API requests in batch requests of up to BATCH_SIZE calls.
+# calls is a list of (key, request, calendar_id), the result is {key: (response, error)} with
+# error None for every call that succeeded. Calls that failed with a retryable error are
+# retried together in a new batch after a backoff, the others are left as they are.
+# Pass idempotent=False when the calls must not be sent twice, see is_retryable.
+def execute_batch(service, calls, name, idempotent=True):
+    results = {}
+    pending = list(calls)
+    attempt = 0
+    while pending:
+        retry = []
+        for start in range(0, len(pending), BATCH_SIZE):
+            retry.extend(_execute_chunk(service, pending[start:start + BATCH_SIZE], name, results, idempotent))
+        if not retry:
+            break
+        if attempt >= MAX_RETRIES:
+            for key, request, calendar_id, error in retry:
+                results[key] = (None, error)
+            metrics.increment('google_calendar.failed', len(retry))
+            metrics.increment(f"google_calendar.failed.{name}", len(retry))
+            break
+
+        if any(is_rate_limited(error) for key, request, calendar_id, error in retry):
+            metrics.increment('google_calendar.rate_limited')
+        delay = max(backoff_delay(attempt, error) for key, request, calendar_id, error in retry)
+        logger.warning("%d calls of Google Calendar batch %s failed, retry %d in %.1fs", len(retry), name, attempt + 1, delay)
+        metrics.increment('google_calendar.retried', len(retry))
+        time.sleep(delay)
+        pending = [(key, request, calendar_id) for key, request, calendar_id, error in retry]
+        attempt += 1
+    return results
@@ -0,0 +1,235 @@
+import json
+import os
+import sys
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import metrics
+
+# Create a custom logger
+logger = logging.getLogger(__name__)
+
+# Set the level of this logger.
+logger.setLevel(logging.DEBUG)
+
+# Create handlers
+c_handler = logging.StreamHandler()
+s_handler = logging.StreamHandler(sys.stdout)
+c_handler.setLevel(logging.DEBUG)
+s_handler.setLevel(logging.DEBUG)
+
+# Create formatters and add it to handlers
+c_format = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+s_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+c_handler.setFormatter(c_format)
+s_handler.setFormatter(s_format)
+
+# Add handlers to the logger
+logger.addHandler(c_handler)
+logger.addHandler(s_handler)
+
+# Load environment variables from .env file
+load_dotenv()
+
+headers = {
+    "Content-Type": "application/json"
+}
+
+# Base URL of the master-UUID service
+BASE_URL = os.getenv('MASTER_UUID_URL', f"http://{os.getenv('RABBITMQ_HOST')}:6000")
+
+# (connect, read) timeouts in seconds, a slow service must never stall the caller indefinitely
+TIMEOUT = (
+    float(os.getenv('MASTER_UUID_CONNECT_TIMEOUT', 3)),
+    float(os.getenv('MASTER_UUID_READ_TIMEOUT', 10))
+)
+
+# Size of the keep-alive connection pool and of the pool used for concurrent lookups
+POOL_SIZE = int(os.getenv('MASTER_UUID_POOL_SIZE', 10))
+
+
+class ServiceIdCache:
+    # Size-bounded LRU cache with a TTL for (master UUID, service) -> service ID.
+    # The mapping hardly ever changes once it is added, so lookups are served
+    # from memory; add_service_id writes through and delete_service_id invalidates.
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (service_id, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, master_uuid, service):
+        key = (master_uuid, service)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                metrics.increment('master_uuid.cache.hits')
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+        metrics.increment('master_uuid.cache.misses')
+        return None
+
+    def put(self, master_uuid, service, service_id):
+        key = (master_uuid, service)
+        with self._lock:
+            self._entries[key] = (service_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                metrics.increment('master_uuid.cache.evictions')
+
+    def invalidate(self, master_uuid, service):
+        with self._lock:
+            self._entries.pop((master_uuid, service), None)
+
+
+cache = ServiceIdCache(
+    max_size=int(os.getenv('MASTER_UUID_CACHE_SIZE', 10000)),
+    ttl=float(os.getenv('MASTER_UUID_CACHE_TTL', 3600))
+)
+
+_session = None
+_executor = None
+_lock = threading.Lock()
+
+
+# Function to get the shared keep-alive HTTP session
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers.update(headers)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='master-uuid')
+        return _executor
+
+
+# Function to POST a payload to an endpoint, returns the response.
+# Raises a requests exception when the service can't be reached or answers with a 5xx,
+# so callers never mistake an outage for an answer.
+def _post(endpoint, payload):
+    start = time.perf_counter()
+    try:
+        response = get_session().post(f"{BASE_URL}/{endpoint}", data=json.dumps(payload), timeout=TIMEOUT)
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error during request to {endpoint}: {e}")
+        metrics.increment(f"master_uuid.{endpoint}.errors")
+        raise
+    finally:
+        metrics.observe(f"master_uuid.{endpoint}", time.perf_counter() - start)
+
+
+def create_master_uuid(service_id, service_name):
+    payload = {
+        "ServiceId": service_id,
+        "Service": service_name
+    }
+    response = _post('createMasterUuid', payload)
+    if response.status_code in (200, 201) and response.json().get("success"):
+        return response.json().get("MasterUuid")
+    else:
+        logger.error(f"No master UUID created: {response.status_code} - {response.text}")
+        return None
+
+
+def add_service_id(master_uuid, service, service_id):
+    payload = {
+        "MasterUuid": master_uuid,
+        "Service": service,
+        "ServiceId": service_id
+    }
+    # Called after the change is committed, a retry of the message can't redo it: log and go on
+    try:
+        response = _post('addServiceId', payload)
+    except requests.exceptions.RequestException:
+        return None
+
+    if response.status_code in (200, 201):
+        cache.put(master_uuid, service, service_id)
+        return response.json()
+    else:
+        logger.error(f"Unexpected response: {response.status_code} - {response.text}")
+        return None
+
+
+def delete_service_id(master_uuid, service):
+    payload = {
+        "MASTERUUID": master_uuid,
+        "NewServiceId": None,
+        "Service": service
+    }
+    cache.invalidate(master_uuid, service)
+    # Called after the change is committed, a retry of the message can't redo it: log and go on
+    try:
+        response = _post('updateServiceId', payload)
+    except requests.exceptions.RequestException:
+        return None
+    finally:
+        # A concurrent lookup may have cached the old mapping while the update was in flight
+        cache.invalidate(master_uuid, service)
+    if response.status_code == 200:
+        return response.json()
+    else:
+        logger.error(f"Unexpected response: {response.status_code} - {response.text}")
+        return None
+
+
+def get_service_id(master_uuid, service_name):
+    service_id = cache.get(master_uuid, service_name)
+    if service_id is not None:
+        return service_id
+    return _fetch_service_id(master_uuid, service_name)
+
+
+# Function to ask the service for a mapping. Returns None only when the service says there is none,
+# an outage or an unexpected answer raises so the caller can retry.
+def _fetch_service_id(master_uuid, service_name):
+    payload = {
+        "MASTERUUID": master_uuid,
+        "Service": service_name
+    }
+    response = _post('getServiceId', payload)
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise RuntimeError(f"Unexpected getServiceId response for {master_uuid}: {response.status_code} - {response.text}")
+    service_id = response.json().get(service_name)
+    if service_id is not None:
+        cache.put(master_uuid, service_name, service_id)
+    return service_id
+
+
+# Function to resolve several master UUIDs, returns a list in the same order.
+# Cached IDs are answered from memory, the rest are fetched concurrently.
+def get_service_ids(master_uuids, service_name):
+    results = [cache.get(master_uuid, service_name) for master_uuid in master_uuids]
+    missing = [i for i, service_id in enumerate(results) if service_id is None]
+    if len(missing) == 1:
+        results[missing[0]] = _fetch_service_id(master_uuids[missing[0]], service_name)
+    elif missing:
+        executor = _get_executor()
+        futures = {i: executor.submit(_fetch_service_id, master_uuids[i], service_name) for i in missing}
+        for i, future in futures.items():
+            results[i] = future.result()
+    return results
@@ -0,0 +1,61 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Simple in-process metrics registry shared by the planning modules.
+# Counters only go up, gauges hold the last value set and timers keep
+# count/total/max so averages can be derived from a snapshot.
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timers = {}
+
+
+# Function to increase a counter
+def increment(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+# Function to set a gauge to its current value
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+# Function to record a duration (in seconds) for a timer
+def observe(name, seconds):
+    with _lock:
+        timer = _timers.get(name)
+        if timer is None:
+            timer = {'count': 0, 'total': 0.0, 'max': 0.0}
+            _timers[name] = timer
+        timer['count'] += 1
+        timer['total'] += seconds
+        if seconds > timer['max']:
+            timer['max'] = seconds
+
+
+# Context manager that records how long the wrapped block took
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+# Function to get a copy of all metrics
+def snapshot():
+    with _lock:
+        timers = {}
+        for name, timer in _timers.items():
+            timers[name] = dict(timer)
+            timers[name]['avg'] = timer['total'] / timer['count'] if timer['count'] else 0.0
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'timers': timers,
+        }
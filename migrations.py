@@ -1,6 +1,20 @@
+import os
 import mysql.connector
 from mysql.connector import Error
+from dotenv import load_dotenv
+import uuid_keys
 
+# Load environment variables from .env file
+load_dotenv()
+
+DB_HOST = os.getenv('DB_HOST', 'mysql')
+DB_PORT = int(os.getenv('DB_PORT', 3306))
+DB_USER = os.getenv('DB_USER', 'root')
+DB_PASSWORD = os.getenv('DB_PASSWORD', 'mypassword')
+DB_DATABASE = os.getenv('DB_DATABASE', 'planning')
+
+# Two runners must never apply the same migration at the same time
+MIGRATION_LOCK_NAME = 'planning_schema_migrations'
 
 
 def create_connection():
@@ -8,28 +22,28 @@ def create_connection():
     try:
         # Connect to MySQL server without specifying a database
         connection = mysql.connector.connect(
-            host='mysql',
-            port=3306,
-            user='root',
-            password='mypassword'
+            host=DB_HOST,
+            port=DB_PORT,
+            user=DB_USER,
+            password=DB_PASSWORD
         )
         cursor = connection.cursor()
 
-        # Check if the 'masterUuid' database exists and create it if it doesn't
-        cursor.execute("CREATE DATABASE IF NOT EXISTS planning")
+        # Check if the database exists and create it if it doesn't
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {DB_DATABASE}")
         connection.commit()
 
         # Close the connection and cursor
         cursor.close()
         connection.close()
 
-        # Connect to the 'masterUuid' database
+        # Connect to the planning database
         connection = mysql.connector.connect(
-            host='mysql',
-            port=3306,
-            user='root',
-            password='mypassword',
-            database='planning'
+            host=DB_HOST,
+            port=DB_PORT,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            database=DB_DATABASE
         )
         print("Connected successfully to the database.")
         return connection
@@ -38,24 +52,38 @@ def create_connection():
         print(error_message)
         return error_message  # Return the error message
 
-def create_tables():
-    """Create Company, User, and Events tables"""
-    connection = create_connection()
-    if isinstance(connection, str):  # Check if connection is an error message
-        return {"error": connection}  # Return error as JSON response
+def add_column_if_missing(cursor, table, column, definition):
+    """Add a column to an existing table unless it is already there"""
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column)
+    )
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
 
-    cursor = connection.cursor()
+def add_index_if_missing(cursor, table, index, definition):
+    """Add an index to an existing table unless it is already there"""
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+        (table, index)
+    )
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"ALTER TABLE {table} ADD {definition}")
+
+# Migrations are forward-only and every step is safe to run again:
+# MySQL commits DDL straight away, so a migration that failed halfway is
+# simply re-run from the start on the next attempt.
 
-    # Define SQL queries to create tables
-    queries = [
-        """
+def migration_0001_create_base_tables(cursor):
+    """Create Company, User, and Events tables"""
+    cursor.execute("""
         CREATE TABLE IF NOT EXISTS Company (
             CompanyId VARCHAR(255) PRIMARY KEY,
             Name VARCHAR(100),
             Email VARCHAR(100)
         )
-        """,
-        """
+    """)
+    cursor.execute("""
         CREATE TABLE IF NOT EXISTS User (
             UserId VARCHAR(255) PRIMARY KEY,
             First_name VARCHAR(50),
@@ -64,10 +92,9 @@ def create_tables():
             CompanyId VARCHAR(255),
             CalendarId VARCHAR(255),
             CalendarLink VARCHAR(255)
-            
         )
-        """,
-        """
+    """)
+    cursor.execute("""
         CREATE TABLE IF NOT EXISTS Events (
             Id INT AUTO_INCREMENT PRIMARY KEY,
             Speaker_email VARCHAR(255),
@@ -79,22 +106,228 @@ def create_tables():
             Max_Registrations INT,
             Available_Seats INT
         )
-        """
-    ]
+    """)
+
+def migration_0002_create_calendar_event_mappings(cursor):
+    """Create the (UserId, EventId) -> GoogleEventId table"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS CalendarEventMappings (
+            UserId VARCHAR(255),
+            EventId INT,
+            CalendarId VARCHAR(255),
+            GoogleEventId VARCHAR(255),
+            PRIMARY KEY (UserId, EventId)
+        )
+    """)
+
+def migration_0003_calendar_sync(cursor):
+    """Add Events.GoogleEventId and the CalendarSyncState table"""
+    add_column_if_missing(cursor, 'Events', 'GoogleEventId', 'VARCHAR(255)')
+    add_index_if_missing(cursor, 'Events', 'uq_events_google_event_id', 'UNIQUE KEY uq_events_google_event_id (GoogleEventId)')
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS CalendarSyncState (
+            CalendarId VARCHAR(255) PRIMARY KEY,
+            SyncToken VARCHAR(1024),
+            UpdatedAt DATETIME
+        )
+    """)
+
+def migration_0004_create_outbox(cursor):
+    """Create the Outbox table"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Outbox (
+            Id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            EntityType VARCHAR(50),
+            EntityId VARCHAR(255),
+            Exchange VARCHAR(255),
+            RoutingKey VARCHAR(255),
+            Payload MEDIUMTEXT,
+            CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def migration_0005_index_user_email(cursor):
+    """Index User.Email for the speaker lookup by email"""
+    add_index_if_missing(cursor, 'User', 'idx_user_email', 'INDEX idx_user_email (Email)')
+
+def migration_0006_index_events_summary_times(cursor):
+    """Index Events(Summary, Start_datetime, End_datetime) for the fetcher's summary/time matching"""
+    add_index_if_missing(cursor, 'Events', 'idx_events_summary_times', 'INDEX idx_events_summary_times (Summary, Start_datetime, End_datetime)')
+
+def migration_0007_events_archive(cursor):
+    """Create EventsArchive for finished events and index Events.End_datetime for archiving"""
+    cursor.execute("CREATE TABLE IF NOT EXISTS EventsArchive LIKE Events")
+    add_index_if_missing(cursor, 'Events', 'idx_events_end', 'INDEX idx_events_end (End_datetime)')
+
+def migration_0008_fetch_cursor(cursor):
+    """Store the fetch window of each calendar in CalendarSyncState"""
+    add_column_if_missing(cursor, 'CalendarSyncState', 'WindowStart', 'DATETIME')
+    add_column_if_missing(cursor, 'CalendarSyncState', 'WindowEnd', 'DATETIME')
+
+def migration_0009_calendar_pool(cursor):
+    """Create the CalendarPool table of ready-made calendars"""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS CalendarPool (
+            CalendarId VARCHAR(255) PRIMARY KEY,
+            CalendarLink VARCHAR(255),
+            ClaimedBy {uuid_keys.column_type()} NULL,
+            CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+            ClaimedAt DATETIME,
+            INDEX idx_calendar_pool_claimed (ClaimedBy, CreatedAt)
+        )
+    """)
+
+def migration_0010_attendance(cursor):
+    """Create the Attendance table and index CalendarEventMappings.EventId"""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS Attendance (
+            UserId {uuid_keys.column_type()},
+            EventId INT,
+            CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (UserId, EventId),
+            INDEX idx_attendance_event (EventId)
+        )
+    """)
+    add_index_if_missing(cursor, 'CalendarEventMappings', 'idx_mappings_event', 'INDEX idx_mappings_event (EventId)')
 
+def migration_0011_archive_event_children(cursor):
+    """Create the archive tables of Attendance and CalendarEventMappings"""
+    cursor.execute("CREATE TABLE IF NOT EXISTS AttendanceArchive LIKE Attendance")
+    cursor.execute("CREATE TABLE IF NOT EXISTS CalendarEventMappingsArchive LIKE CalendarEventMappings")
+
+def migration_0012_outbox_render_attempts(cursor):
+    """Count failed renders of pending outbox messages and park the ones that keep failing"""
+    add_column_if_missing(cursor, 'Outbox', 'Attempts', 'INT NOT NULL DEFAULT 0')
+    add_column_if_missing(cursor, 'Outbox', 'RetryAt', 'DATETIME NULL')
+    add_column_if_missing(cursor, 'Outbox', 'ParkedAt', 'DATETIME NULL')
+
+def migration_0013_events_master_uuid(cursor):
+    """Store the master UUID of every event on the Events row"""
+    add_column_if_missing(cursor, 'Events', 'MasterUuid', f"{uuid_keys.column_type()} NULL")
+    add_column_if_missing(cursor, 'EventsArchive', 'MasterUuid', f"{uuid_keys.column_type()} NULL")
+
+# UUID key columns stored as BINARY(16) when UUID_STORAGE=binary
+UUID_KEY_COLUMNS = [
+    ('Company', 'CompanyId'),
+    ('User', 'UserId'),
+    ('User', 'CompanyId'),
+    ('CalendarEventMappings', 'UserId'),
+    ('CalendarPool', 'ClaimedBy'),
+    ('Attendance', 'UserId'),
+    ('AttendanceArchive', 'UserId'),
+    ('CalendarEventMappingsArchive', 'UserId'),
+    ('Events', 'MasterUuid'),
+    ('EventsArchive', 'MasterUuid'),
+]
+
+def convert_uuid_column_to_binary(cursor, table, column):
+    """Convert a UUID text column to BINARY(16), keeping its indexes"""
+    cursor.execute(
+        "SELECT DATA_TYPE FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column)
+    )
+    data_type = cursor.fetchone()[0].lower()
+    if data_type == 'binary':
+        return
+
+    # A blank key means no key, the same as uuid_keys.to_db stores it
+    cursor.execute(f"UPDATE {table} SET {column} = NULL WHERE TRIM({column}) = ''")
+
+    if data_type != 'varbinary':
+        # Refuse to convert anything that is not a UUID, it would be lost
+        cursor.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE {column} IS NOT NULL "
+            f"AND REPLACE({column}, '-', '') NOT REGEXP '^[0-9a-fA-F]{{32}}$'"
+        )
+        if cursor.fetchone()[0]:
+            raise Error(msg=f"{table}.{column} contains values that are not UUIDs")
+        cursor.execute(f"ALTER TABLE {table} MODIFY {column} VARBINARY(255)")
+
+    # Rows that still hold the text form, a rerun after a failure skips the converted ones
+    cursor.execute(f"UPDATE {table} SET {column} = UNHEX(REPLACE({column}, '-', '')) WHERE LENGTH({column}) > 16")
+    cursor.execute(f"ALTER TABLE {table} MODIFY {column} BINARY(16)")
+
+def migration_0100_binary_uuid_keys(cursor):
+    """Store UUID keys as BINARY(16)"""
+    for table, column in UUID_KEY_COLUMNS:
+        convert_uuid_column_to_binary(cursor, table, column)
+
+# Every migration ever released, in order. Never change or remove an entry, add a new one instead.
+MIGRATIONS = [
+    (1, migration_0001_create_base_tables),
+    (2, migration_0002_create_calendar_event_mappings),
+    (3, migration_0003_calendar_sync),
+    (4, migration_0004_create_outbox),
+    (5, migration_0005_index_user_email),
+    (6, migration_0006_index_events_summary_times),
+    (7, migration_0007_events_archive),
+    (8, migration_0008_fetch_cursor),
+    (9, migration_0009_calendar_pool),
+    (10, migration_0010_attendance),
+    (11, migration_0011_archive_event_children),
+    (12, migration_0012_outbox_render_attempts),
+    (13, migration_0013_events_master_uuid),
+]
+
+# Opt-in migrations, only applied when their storage format is enabled (see uuid_keys.py).
+# They run after the regular ones and there is no way back once applied.
+if uuid_keys.BINARY_UUIDS:
+    MIGRATIONS.append((100, migration_0100_binary_uuid_keys))
+
+def get_applied_versions(cursor):
+    """Return the versions recorded in SchemaMigrations"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS SchemaMigrations (
+            Version INT PRIMARY KEY,
+            Description VARCHAR(255),
+            AppliedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT Version FROM SchemaMigrations")
+    return {row[0] for row in cursor.fetchall()}
+
+def run_migrations():
+    """Apply every migration that has not been applied yet"""
+    connection = create_connection()
+    if isinstance(connection, str):  # Check if connection is an error message
+        return {"error": connection}  # Return error as JSON response
+
+    cursor = connection.cursor()
     try:
-        for query in queries:
-            cursor.execute(query)
-        connection.commit()
-        print("Tables successfully created.")
-        return {"success": True, "message": "Tables successfully created."}
+        cursor.execute("SELECT GET_LOCK(%s, 60)", (MIGRATION_LOCK_NAME,))
+        if cursor.fetchone()[0] != 1:
+            return {"error": "Another migration run is in progress"}
+
+        applied = get_applied_versions(cursor)
+        newly_applied = []
+        for version, migration in MIGRATIONS:
+            if version in applied:
+                continue
+            migration(cursor)
+            cursor.execute(
+                "INSERT INTO SchemaMigrations (Version, Description) VALUES (%s, %s)",
+                (version, migration.__doc__)
+            )
+            connection.commit()
+            newly_applied.append(version)
+            print(f"Applied migration {version}: {migration.__doc__}")
+
+        message = f"Applied migrations {newly_applied}." if newly_applied else "Database schema is up to date."
+        print(message)
+        return {"success": True, "message": message}
     except Error as e:
-        error_message = f"Failed to create tables: {e}"
+        error_message = f"Failed to apply migrations: {e}"
         print(error_message)
         return {"error": error_message}  # Return error as JSON response
     finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK_NAME,))
+        cursor.fetchone()
         cursor.close()
         connection.close()
 
+def create_tables():
+    """Create or upgrade all tables, kept for existing callers"""
+    return run_migrations()
+
 if __name__ == '__main__':
-    create_tables()
+    run_migrations()
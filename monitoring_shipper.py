@@ -0,0 +1,152 @@
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import logging
+from dotenv import load_dotenv
+import metrics
+import rabbitmq_publisher
+
+# Create a custom logger
+logger = logging.getLogger(__name__)
+
+# Set the level of this logger.
+logger.setLevel(logging.DEBUG)
+
+# Create handlers
+c_handler = logging.StreamHandler()
+s_handler = logging.StreamHandler(sys.stdout)
+c_handler.setLevel(logging.DEBUG)
+s_handler.setLevel(logging.DEBUG)
+
+# Create formatters and add it to handlers
+c_format = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+s_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+c_handler.setFormatter(c_format)
+s_handler.setFormatter(s_format)
+
+# Add handlers to the logger
+logger.addHandler(c_handler)
+logger.addHandler(s_handler)
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Seconds between two metrics snapshots sent to monitoring, 0 disables them
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', 60))
+
+
+class MonitoringShipper:
+    # Ships LogEntry messages to monitoring from a background thread.
+    #
+    # submit() never blocks: entries go into a bounded in-memory queue and are
+    # published in batches once batch_size entries are waiting or
+    # flush_interval seconds have passed since the first one.
+    #
+    # Overflow policy: when the queue is full the new entry is dropped.
+    # A batch that still fails after the publisher's reconnect-and-retry is
+    # dropped as well, so a monitoring outage can't grow memory or stall
+    # message processing. Every drop is counted in monitoring.logs.dropped.
+
+    def __init__(self, exchange, routing_key, max_queue=10000, batch_size=100, flush_interval=1.0):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='monitoring-shipper', daemon=True)
+        self._thread.start()
+
+    def submit(self, xml_str):
+        try:
+            self._queue.put_nowait(xml_str)
+            metrics.increment('monitoring.logs.queued')
+        except queue.Full:
+            metrics.increment('monitoring.logs.dropped')
+
+    def stop(self, timeout=5.0):
+        # Flush what is still queued before the process exits
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._send(batch)
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopping.is_set():
+                remaining = 0
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _send(self, batch):
+        messages = [(self.exchange, self.routing_key, xml_str, None) for xml_str in batch]
+        try:
+            rabbitmq_publisher.get_publisher().publish_batch(messages)
+            metrics.increment('monitoring.logs.sent', len(batch))
+        except Exception as e:
+            # Only log locally, sending this to monitoring would feed the same queue
+            logger.error(f"Dropping {len(batch)} monitoring log entries: {e}")
+            metrics.increment('monitoring.logs.dropped', len(batch))
+
+
+_shipper = None
+_shipper_lock = threading.Lock()
+
+
+# Function to get the process-wide shipper, started on first use
+def get_shipper():
+    global _shipper
+    with _shipper_lock:
+        if _shipper is None:
+            _shipper = MonitoringShipper(
+                exchange='amq.topic',
+                routing_key='logs',
+                max_queue=int(os.getenv('MONITORING_QUEUE_SIZE', 10000)),
+                batch_size=int(os.getenv('MONITORING_BATCH_SIZE', 100)),
+                flush_interval=float(os.getenv('MONITORING_FLUSH_INTERVAL', 1.0))
+            )
+            atexit.register(_shipper.stop)
+        return _shipper
+
+
+# Function to send a snapshot of the metrics of this process to monitoring, as a LogEntry with FunctionName Metrics
+def report_metrics():
+    # Imported here, publisher_planning itself uses the shipper
+    import publisher_planning
+    publisher_planning.sendLogsToMonitoring('Metrics', json.dumps(metrics.snapshot(), sort_keys=True), False)
+
+
+def _run_metrics_reporter(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            report_metrics()
+        except Exception as e:
+            logger.error(f"Error reporting metrics: {e}")
+
+
+# Function to send a metrics snapshot every interval seconds from a background thread of the calling process
+def start_metrics_reporter(interval=METRICS_INTERVAL):
+    if interval <= 0:
+        return None
+    thread = threading.Thread(target=_run_metrics_reporter, args=(interval,), name='metrics-reporter', daemon=True)
+    thread.start()
+    return thread
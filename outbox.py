@@ -0,0 +1,245 @@
+import os
+import sys
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import pika
+import mysql.connector
+from dotenv import load_dotenv
+import db_pool
+import metrics
+import monitoring_shipper
+import rabbitmq_publisher
+
+# Create a custom logger
+logger = logging.getLogger(__name__)
+
+# Set the level of this logger.
+logger.setLevel(logging.DEBUG)
+
+# Create handlers
+c_handler = logging.StreamHandler()
+s_handler = logging.StreamHandler(sys.stdout)
+c_handler.setLevel(logging.DEBUG)
+s_handler.setLevel(logging.DEBUG)
+
+# Create formatters and add it to handlers
+c_format = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+s_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+c_handler.setFormatter(c_format)
+s_handler.setFormatter(s_format)
+
+# Add handlers to the logger
+logger.addHandler(c_handler)
+logger.addHandler(s_handler)
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Transactional outbox for outbound XML messages.
+# Messages are written to the Outbox table in the same transaction as the
+# change they describe; the relay (run this module) publishes them in Id
+# order and deletes them once RabbitMQ has taken them.
+#
+# A message whose payload needs calls that can't run inside the caller's
+# transaction (like creating a master UUID for a new event) is written as a
+# pending row without a payload. The relay renders it just before publishing.
+#
+# Messages of one entity (EntityType, EntityId) are published in order: when a
+# pending message can't be rendered, the later messages of that entity wait
+# for it while the other entities go on. A failed render is tried again after
+# OUTBOX_RENDER_RETRY_DELAY seconds, after OUTBOX_RENDER_ATTEMPTS failures the
+# row is parked (ParkedAt is set) for inspection and no longer holds anything up.
+
+# Number of outbox rows published per broker round trip
+BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 100))
+
+# Seconds the relay waits before polling an empty outbox again
+POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 0.5))
+
+# Only one relay may publish at a time, otherwise per-entity ordering is lost
+RELAY_LOCK_NAME = 'planning_outbox_relay'
+
+# Number of pending messages rendered at the same time
+RENDER_WORKERS = int(os.getenv('OUTBOX_RENDER_WORKERS', 4))
+
+# Failed renders of a pending message before it is parked, and seconds between two attempts
+RENDER_ATTEMPTS = int(os.getenv('OUTBOX_RENDER_ATTEMPTS', 10))
+RENDER_RETRY_DELAY = int(os.getenv('OUTBOX_RENDER_RETRY_DELAY', 30))
+
+# Outbox messages are persistent, a broker restart must not lose them after they left the outbox
+MESSAGE_PROPERTIES = pika.BasicProperties(delivery_mode=2)
+
+_executor = None
+
+
+# Function to add a message to the outbox using the caller's cursor, it is sent once the caller commits.
+# A payload of None makes it a pending message, rendered by the relay (see render).
+def enqueue(cursor, entity_type, entity_id, exchange, routing_key, payload):
+    query = "INSERT INTO Outbox (EntityType, EntityId, Exchange, RoutingKey, Payload) VALUES (%s, %s, %s, %s, %s)"
+    cursor.execute(query, (entity_type, str(entity_id), exchange, routing_key, payload))
+
+
+# Function to add a message to the outbox in a transaction of its own
+def enqueue_now(entity_type, entity_id, exchange, routing_key, payload):
+    connection = db_pool.get_connection()
+    try:
+        cursor = connection.cursor()
+        enqueue(cursor, entity_type, entity_id, exchange, routing_key, payload)
+        connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
+
+
+# Function to render the payload of a pending message, None when there is nothing to send any more
+def render(entity_type, entity_id):
+    if entity_type == 'event':
+        # Imported here, publisher_planning itself writes to the outbox
+        import publisher_planning
+        return publisher_planning.render_event_xml(entity_id)
+    raise ValueError(f"No renderer for pending outbox messages of type {entity_type}")
+
+
+# Function to render pending rows, given as (Id, EntityType, EntityId), in parallel.
+# Returns {Id: payload} for the rows that were rendered.
+def render_pending(rows):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix='outbox-render')
+
+    futures = {
+        row_id: _executor.submit(render, entity_type, entity_id)
+        for row_id, entity_type, entity_id in rows
+    }
+    rendered = {}
+    for row_id, future in futures.items():
+        try:
+            rendered[row_id] = future.result()
+        except Exception as e:
+            logger.error("Error rendering outbox message %s: %s", row_id, e)
+            metrics.increment('outbox.render_failed')
+    return rendered
+
+
+# Function to publish one batch of outbox rows, returns the number of rows handled
+def relay_batch(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT Id, EntityType, EntityId, Exchange, RoutingKey, Payload, Attempts, RetryAt IS NULL OR RetryAt <= UTC_TIMESTAMP(),
+                   TIMESTAMPDIFF(SECOND, CreatedAt, NOW())
+            FROM Outbox
+            WHERE ParkedAt IS NULL
+            ORDER BY Id
+            LIMIT %s
+        """, (BATCH_SIZE,))
+        rows = cursor.fetchall()
+        selected_at = time.monotonic()
+        connection.commit()
+        if not rows:
+            return 0
+
+        # Store the rendered payloads before publishing, a crash after this point doesn't render them (and create master UUIDs) again
+        pending = [row for row in rows if row[5] is None and row[7]]
+        rendered = render_pending([row[:3] for row in pending])
+        failed = [row for row in pending if row[0] not in rendered]
+        if rendered:
+            cursor.executemany(
+                "UPDATE Outbox SET Payload = %s WHERE Id = %s",
+                [(payload, row_id) for row_id, payload in rendered.items() if payload is not None]
+            )
+        if failed:
+            # MySQL assigns left to right: ParkedAt sees the new number of attempts
+            cursor.executemany(
+                "UPDATE Outbox SET Attempts = Attempts + 1, RetryAt = UTC_TIMESTAMP() + INTERVAL %s SECOND, "
+                "ParkedAt = IF(Attempts >= %s, UTC_TIMESTAMP(), NULL) WHERE Id = %s",
+                [(RENDER_RETRY_DELAY, RENDER_ATTEMPTS, row[0]) for row in failed]
+            )
+            for row in failed:
+                if row[6] + 1 >= RENDER_ATTEMPTS:
+                    logger.error("Outbox message %s (%s %s) parked after %d failed renders", row[0], row[1], row[2], row[6] + 1)
+                    metrics.increment('outbox.parked')
+        if rendered or failed:
+            connection.commit()
+
+        messages = []
+        ids = []
+        ages = []
+        blocked = set()
+        for row_id, entity_type, entity_id, exchange, routing_key, payload, attempts, ready, age in rows:
+            if (entity_type, entity_id) in blocked:
+                continue
+            if payload is None:
+                if row_id not in rendered:
+                    # Not rendered (failed or waiting for its next attempt), the later messages of this entity wait for it
+                    blocked.add((entity_type, entity_id))
+                    continue
+                payload = rendered[row_id]
+                if payload is None:
+                    # Nothing to send any more, the row is simply removed
+                    ids.append(row_id)
+                    continue
+            messages.append((exchange, routing_key, payload, MESSAGE_PROPERTIES))
+            ids.append(row_id)
+            ages.append(age)
+        if not ids:
+            return 0
+
+        # The batch is published in Id order and confirmed as a whole
+        rabbitmq_publisher.get_publisher().publish_batch(messages)
+
+        # A crash between the publish and this delete sends the batch again (at-least-once)
+        cursor.execute(f"DELETE FROM Outbox WHERE Id IN ({', '.join(['%s'] * len(ids))})", ids)
+        connection.commit()
+        metrics.increment('outbox.published', len(messages))
+        # Time from the commit of the change (e.g. the fetch of a new event) until RabbitMQ took its message
+        elapsed = time.monotonic() - selected_at
+        for age in ages:
+            metrics.observe('outbox.publish_latency', age + elapsed)
+        return len(ids)
+    finally:
+        cursor.close()
+
+
+# Function to record the outbox backlog (parked rows apart) as a queue-depth metric
+def report_backlog(connection):
+    cursor = connection.cursor()
+    cursor.execute("SELECT COUNT(*) - COUNT(ParkedAt), COUNT(ParkedAt) FROM Outbox")
+    backlog, parked = cursor.fetchone()
+    cursor.close()
+    connection.commit()
+    metrics.set_gauge('outbox.backlog', backlog)
+    metrics.set_gauge('outbox.parked_rows', parked)
+    return backlog
+
+
+def run_relay():
+    connection = db_pool.get_connection()
+    cursor = connection.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, -1)", (RELAY_LOCK_NAME,))
+    cursor.fetchone()
+    cursor.close()
+    logger.info("Outbox relay started")
+
+    while True:
+        try:
+            published = relay_batch(connection)
+            if published < BATCH_SIZE:
+                report_backlog(connection)
+                time.sleep(POLL_INTERVAL)
+        except mysql.connector.Error as e:
+            logger.error("Database error in outbox relay: %s", e)
+            connection.rollback()
+            time.sleep(POLL_INTERVAL)
+        except Exception as e:
+            # Publishing failed, the rows stay in the outbox and are retried
+            logger.error("Error publishing outbox batch: %s", e)
+            connection.rollback()
+            time.sleep(POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    # The backlog gauge and the other relay metrics go to monitoring
+    monitoring_shipper.start_metrics_reporter()
+    run_relay()
@@ -1,16 +1,16 @@
-import json
 import re
-import time
 import xml.etree.ElementTree as ET
-import mysql.connector
-import pika
+import db_pool
+import uuid_keys
+import monitoring_shipper
+import outbox
 from dotenv import load_dotenv
 import os
 import logging
 import sys
 from datetime import datetime
 
-import requests
+import master_uuid_client
 
 # Create a custom logger
 logger = logging.getLogger(__name__)
@@ -45,38 +45,16 @@ logger.error('This is an error')
 # Load environment variables from .env file
 load_dotenv()
 
-headers = {
-    "Content-Type": "application/json"
-}
-
-def create_master_uuid(service_id, service_name):
-    url = f"http://{os.getenv('RABBITMQ_HOST')}:6000/createMasterUuid"
-    payload = {
-        "ServiceId": service_id,
-        "Service": service_name
-    }
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
-    if response.status_code == 200 and response.json().get("success") or response.status_code == 201 and response.json().get("success"):
-        return response.json().get("MasterUuid")
-    else:
-        return None
-
 # Function to fetch user data from MySQL database based on user_id
 def fetch_user_data(user_id):
-    # Establish database connection
-    conn = mysql.connector.connect(
-        host=os.getenv('DB_HOST'),
-        port=os.getenv('DB_PORT', 3306),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        database=os.getenv('DB_DATABASE')
-    )
+    # Check out a pooled database connection
+    conn = db_pool.get_connection()
 
     cursor = conn.cursor()
 
     # Fetch user data based on user_id
     query = "SELECT UserId, CalendarLink FROM User WHERE UserId = %s"
-    cursor.execute(query, (user_id,))
+    cursor.execute(query, (uuid_keys.to_db(user_id),))
     user_data = cursor.fetchone()
 
     # Close cursor and connection
@@ -85,25 +63,23 @@ def fetch_user_data(user_id):
 
     return user_data
 
-# Function to fetch event data from MySQL database based on event_id
-def fetch_event_data(event_id):
-    # Establish database connection
-    conn = mysql.connector.connect(
-        host=os.getenv('DB_HOST'),
-        port=os.getenv('DB_PORT', 3306),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        database=os.getenv('DB_DATABASE')
-    )
-
-    cursor = conn.cursor()
-
-    # Fetch event data based on event_id
+# Function to fetch event data from MySQL database based on event_id, with a cursor inside the caller's transaction
+def fetch_event_data(event_id, cursor=None):
     query = """
         SELECT Id, Speaker_email, Summary, Start_datetime, End_datetime, Location, Description, Max_Registrations, Available_Seats
         FROM Events
         WHERE id = %s
     """
+    if cursor is not None:
+        cursor.execute(query, (event_id,))
+        return cursor.fetchone()
+
+    # Check out a pooled database connection
+    conn = db_pool.get_connection()
+
+    cursor = conn.cursor()
+
+    # Fetch event data based on event_id
     cursor.execute(query, (event_id,))
     event_data = cursor.fetchone()
 
@@ -113,32 +89,18 @@ def fetch_event_data(event_id):
 
     return event_data
 
-# Function to publish XML object to RabbitMQ
-def publish_xml_message(exchange_name, routing_key, xml_str):
-    # Publish the XML object to RabbitMQ
-    credentials = pika.PlainCredentials(os.getenv('RABBITMQ_USER'), os.getenv('RABBITMQ_PASSWORD'))
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host=os.getenv('RABBITMQ_HOST'), credentials=credentials))
-    channel = connection.channel()
-
-    # Declare the exchange
-    channel.exchange_declare(exchange=exchange_name, exchange_type='topic', durable=True)
-
-    # Publish the message
-    channel.basic_publish(exchange=exchange_name, routing_key=routing_key, body=xml_str)
-
-    # Close the connection
-    connection.close()
-        
-    logger.info(f"XML message published to RabbitMQ with routing key '{routing_key}'")
-
-
-# Function to publish XML user-object to RabbitMQ
-def publish_user_xml(user_id):
+# Function to publish XML user-object to RabbitMQ.
+# With a cursor the message goes into the caller's transaction and is only sent once it commits.
+def publish_user_xml(user_id, cursor=None):
     # Fetch user data from MySQL database
-    user_data = fetch_user_data(user_id)
+    if cursor is not None:
+        cursor.execute("SELECT UserId, CalendarLink FROM User WHERE UserId = %s", (uuid_keys.to_db(user_id),))
+        user_data = cursor.fetchone()
+    else:
+        user_data = fetch_user_data(user_id)
 
     if user_data:
-        user_id, calendar_link = user_data
+        user_id, calendar_link = uuid_keys.from_db(user_data[0]), user_data[1]
 
         # Construct XML document based on schema
         user_elem = ET.Element('user')
@@ -172,93 +134,152 @@ def publish_user_xml(user_id):
         # Ensure all empty elements are represented with explicit opening and closing tags
         xml_str = re.sub(r'<(\w+)\s*/>', r'<\1></\1>', xml_str)
 
-        publish_xml_message('amq.topic', 'user.planning', xml_str)
-        
-        print(f"XML message published to RabbitMQ for user_id: {user_id}")
-        log = f"XML message published to RabbitMQ for user_id: {user_id}"
+        # Write the XML to the outbox, the outbox relay publishes it to RabbitMQ
+        if cursor is not None:
+            outbox.enqueue(cursor, 'user', user_id, 'amq.topic', 'user.planning', xml_str)
+        else:
+            outbox.enqueue_now('user', user_id, 'amq.topic', 'user.planning', xml_str)
+
+        print(f"XML message queued for RabbitMQ for user_id: {user_id}")
+        log = f"XML message queued for RabbitMQ for user_id: {user_id}"
         sendLogsToMonitoring("Publish_user_object", log, False)
     else:
         print(f"User with user_id '{user_id}' not found in the database.")
 
-def get_user_and_company_ids(speaker_email):
+# With a cursor the lookup runs in the caller's transaction instead of on a connection of its own.
+def get_user_and_company_ids(speaker_email, cursor=None):
     # SQL query to get user_id and company_id from the users table using speaker_email
-    conn = mysql.connector.connect(
-        host=os.getenv('DB_HOST'),
-        port=os.getenv('DB_PORT', 3306),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        database=os.getenv('DB_DATABASE')
-    )
-
-    cursor = conn.cursor()
     query = "SELECT UserId, CompanyId FROM User WHERE email = %s"
-    cursor.execute(query, (speaker_email,))
-    result = cursor.fetchone()
-    cursor.close()
+    if cursor is not None:
+        cursor.execute(query, (speaker_email,))
+        result = cursor.fetchone()
+    else:
+        conn = db_pool.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, (speaker_email,))
+        result = cursor.fetchone()
+        cursor.close()
+        conn.close()
     if result:
-        return result[0], result[1]  # user_id, company_id
+        return uuid_keys.from_db(result[0]), uuid_keys.from_db(result[1])  # user_id, company_id
     else:
         return None, None
-# Function to publish XML event object to RabbitMQ
-def publish_event_xml(results):
-    logger.info("Entered Publisher")
+# Function to build the XML event object of an event row.
+# speaker_ids is the (user_id, company_id) of the speaker, see get_user_and_company_ids.
+def build_event_xml(results, crud_operation, event_id, speaker_ids):
+    (id, speaker_email, title, start_datetime, end_datetime, location, description, max_registrations, available_seats) = results
 
-    time.sleep(10) # Sleep for 5 seconds to make sure the event is inserted into the database
-    # Fetch event data from MySQL database
-    # event_data = fetch_event_data(event_id)
+    # Extract date and time components
+    event_date = start_datetime.date()
+    start_time = start_datetime.time()
+    end_time = end_datetime.time()
 
-    if results:
-        (id, speaker_email, title, start_datetime, end_datetime, location, description, max_registrations, available_seats) = results
+    # Construct XML document for event
+    event_elem = ET.Element('event')
 
-        event_id = create_master_uuid(id, 'planning')
+    # Define elements with extracted values
+    elements = [
+        ('routing_key', 'event.planning'),
+        ('crud_operation', crud_operation),
+        ('id', str(event_id)),
+        ('title', str(title)),
+        ('date', str(event_date)),
+        ('start_time', str(start_time)),
+        ('end_time', str(end_time)),
+        ('location', location),
+        ('description', description),
+    ]
 
-        # Extract date and time components
-        event_date = start_datetime.date()
-        start_time = start_datetime.time()
-        end_time = end_datetime.time()
+    for elem_name, elem_value in elements:
+        ET.SubElement(event_elem, elem_name).text = elem_value
 
-        # Construct XML document for event
-        event_elem = ET.Element('event')
+    # Add speaker element with sub-elements between location and max_registrations
+    user_id, company_id = speaker_ids
+    speaker_elem = ET.SubElement(event_elem, 'speaker')
+    ET.SubElement(speaker_elem, 'user_id').text = user_id
+    ET.SubElement(speaker_elem, 'company_id').text = company_id
 
-        # Define elements with extracted values
-        elements = [
-            ('routing_key', 'event.planning'),
-            ('crud_operation', 'create'),
-            ('id', str(event_id)),
-            ('title', str(title)),
-            ('date', str(event_date)),
-            ('start_time', str(start_time)),
-            ('end_time', str(end_time)),
-            ('location', location),
-            ('description', description),
-        ]
+    # Add max_registrations and available_seats elements
+    ET.SubElement(event_elem, 'max_registrations').text = str(max_registrations)
+    ET.SubElement(event_elem, 'available_seats').text = str(available_seats)
 
-        for elem_name, elem_value in elements:
-            ET.SubElement(event_elem, elem_name).text = elem_value
+    # Create XML string
+    xml_str = ET.tostring(event_elem, encoding='utf-8', method='xml')
+    xml_str = xml_str.decode('utf-8')  # Convert bytes to string
 
-        # Fetch user_id and company_id using speaker_email
-        user_id, company_id = get_user_and_company_ids(speaker_email)
-        # Add speaker element with sub-elements between location and max_registrations
-        speaker_elem = ET.SubElement(event_elem, 'speaker')
-        ET.SubElement(speaker_elem, 'user_id').text = user_id
-        ET.SubElement(speaker_elem, 'company_id').text = company_id
+    # Ensure all empty elements are represented with explicit opening and closing tags
+    return re.sub(r'<(\w+)\s*/>', r'<\1></\1>', xml_str)
+
+
+# Function to get the master UUID stored on an event row, None when it has none yet
+def get_event_master_uuid(event_id, cursor):
+    cursor.execute("SELECT MasterUuid FROM Events WHERE Id = %s", (event_id,))
+    row = cursor.fetchone()
+    return uuid_keys.from_db(row[0]) if row else None
+
+
+# Function to render the XML of a new event for the outbox relay, see outbox.render_pending.
+# Runs after the event has been committed, so it can call the master UUID service.
+# Returns None when the event no longer exists.
+#
+# The master UUID is stored on the event row before the row is read for the XML. A change
+# committed before that is in the XML; a change that commits after it sees the master UUID
+# and publishes its own update (see event_fetcher.publish_changes).
+def render_event_xml(event_id):
+    # Outbox entity ids are text, Events.Id is an INT
+    event_id = int(event_id)
+    conn = db_pool.get_connection()
+    try:
+        cursor = conn.cursor()
+        master_event_id = get_event_master_uuid(event_id, cursor)
+        conn.commit()
+        if master_event_id is None:
+            master_event_id = master_uuid_client.create_master_uuid(event_id, 'planning')
+            if master_event_id is None:
+                # Raising keeps the message in the outbox, the relay tries again later
+                raise RuntimeError(f"No master UUID could be created for event {event_id}")
+            cursor.execute(
+                "UPDATE Events SET MasterUuid = %s WHERE Id = %s AND MasterUuid IS NULL",
+                (uuid_keys.to_db(master_event_id), event_id)
+            )
+            conn.commit()
+
+        results = fetch_event_data(event_id, cursor)
+        speaker_ids = get_user_and_company_ids(results[1], cursor) if results else None
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+
+    if results is None:
+        logger.warning(f"Event {event_id} no longer exists, its XML is not published")
+        return None
+    return build_event_xml(results, 'create', master_event_id, speaker_ids)
 
-        # Add max_registrations and available_seats elements
-        ET.SubElement(event_elem, 'max_registrations').text = str(max_registrations)
-        ET.SubElement(event_elem, 'available_seats').text = str(available_seats)
 
-        # Create XML string
-        xml_str = ET.tostring(event_elem, encoding='utf-8', method='xml')
-        xml_str = xml_str.decode('utf-8')  # Convert bytes to string
+# Function to publish XML event object to RabbitMQ.
+# New events get a master UUID, for an update or delete pass the master UUID the event already has.
+# With a cursor the message goes into the caller's transaction and is only sent once it commits.
+# speaker_ids (see get_user_and_company_ids) are looked up with the cursor when they aren't passed.
+def publish_event_xml(results, crud_operation='create', event_id=None, cursor=None, speaker_ids=None):
+    logger.info("Entered Publisher")
 
-        # Ensure all empty elements are represented with explicit opening and closing tags
-        xml_str = re.sub(r'<(\w+)\s*/>', r'<\1></\1>', xml_str)
+    if results:
+        if event_id is None:
+            event_id = master_uuid_client.create_master_uuid(results[0], 'planning')
+
+        if speaker_ids is None:
+            speaker_ids = get_user_and_company_ids(results[1], cursor)
+        xml_str = build_event_xml(results, crud_operation, event_id, speaker_ids)
 
-        # Publish the event XML object to RabbitMQ
-        publish_xml_message('amq.topic', 'event.planning', xml_str)
+        # Write the event XML object to the outbox, the outbox relay publishes it to RabbitMQ
+        if cursor is not None:
+            outbox.enqueue(cursor, 'event', results[0], 'amq.topic', 'event.planning', xml_str)
+        else:
+            outbox.enqueue_now('event', results[0], 'amq.topic', 'event.planning', xml_str)
 
     else:
-        print(f"Event with event_id '{id}' not found in the database.")
+        print("Event not found in the database.")
 
 
 def sendLogsToMonitoring(functionName, logMessage, isError):
@@ -281,8 +302,8 @@ def sendLogsToMonitoring(functionName, logMessage, isError):
     xml_str = ET.tostring(log_elem, encoding='utf-8', method='xml')
     xml_str = xml_str.decode('utf-8')  # Convert bytes to string
 
-    # Publish Log XML object to RabbitMQ
-    publish_xml_message('amq.topic', 'logs', xml_str)
+    # Hand the Log XML object to the background shipper, it is published to RabbitMQ in batches
+    monitoring_shipper.get_shipper().submit(xml_str)
 
 
 # Example usage
@@ -0,0 +1,127 @@
+import atexit
+import os
+import sys
+import threading
+import logging
+import pika
+from dotenv import load_dotenv
+
+# Create a custom logger
+logger = logging.getLogger(__name__)
+
+# Set the level of this logger.
+logger.setLevel(logging.DEBUG)
+
+# Create handlers
+c_handler = logging.StreamHandler()
+s_handler = logging.StreamHandler(sys.stdout)
+c_handler.setLevel(logging.DEBUG)
+s_handler.setLevel(logging.DEBUG)
+
+# Create formatters and add it to handlers
+c_format = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+s_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+c_handler.setFormatter(c_format)
+s_handler.setFormatter(s_format)
+
+# Add handlers to the logger
+logger.addHandler(c_handler)
+logger.addHandler(s_handler)
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class RabbitMQPublisher:
+    # Long-lived publisher that reuses one connection for every batch.
+    # pika connections are not thread-safe, so every call holds a lock.
+    # With confirms enabled batches are published on a transactional channel,
+    # so the broker takes the whole batch in one round trip. A broken
+    # connection is replaced and the publish retried once.
+
+    def __init__(self, host, credentials, confirms=True, heartbeat=60):
+        self.host = host
+        self.credentials = credentials
+        self.confirms = confirms
+        self.heartbeat = heartbeat
+        self._lock = threading.RLock()
+        self._connection = None
+        self._channel = None
+        self._declared_exchanges = set()
+
+    # messages is a list of (exchange, routing_key, body, properties) tuples
+    def publish_batch(self, messages):
+        if not messages:
+            return
+        with self._lock:
+            self._with_reconnect(lambda: self._publish_many(messages))
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._connection.is_open:
+                try:
+                    self._connection.close()
+                except pika.exceptions.AMQPError:
+                    pass
+            self._reset()
+
+    def _with_reconnect(self, action):
+        for attempt in (1, 2):
+            try:
+                self._ensure_connection()
+                return action()
+            except pika.exceptions.AMQPError as e:
+                logger.warning(f"Publishing to RabbitMQ failed (attempt {attempt}): {e!r}")
+                self._reset()
+                if attempt == 2:
+                    raise
+
+    def _publish_many(self, messages):
+        for exchange, routing_key, body, properties in messages:
+            self._declare_exchange(self._channel, exchange)
+            self._channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+        if self.confirms:
+            # Wait once for the broker to take the whole batch
+            self._channel.tx_commit()
+
+    def _declare_exchange(self, channel, exchange):
+        # The default exchange ('') can't be declared
+        if exchange and exchange not in self._declared_exchanges:
+            channel.exchange_declare(exchange=exchange, exchange_type='topic', durable=True)
+            self._declared_exchanges.add(exchange)
+
+    def _ensure_connection(self):
+        if self._connection is not None and self._connection.is_open and self._channel.is_open:
+            return
+
+        self._reset()
+        parameters = pika.ConnectionParameters(host=self.host, credentials=self.credentials, heartbeat=self.heartbeat)
+        self._connection = pika.BlockingConnection(parameters)
+        self._channel = self._connection.channel()
+        if self.confirms:
+            self._channel.tx_select()
+        logger.info("Publisher connected to RabbitMQ")
+
+    def _reset(self):
+        self._connection = None
+        self._channel = None
+        self._declared_exchanges = set()
+
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+# Function to get the process-wide publisher, connected on first use
+def get_publisher():
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            _publisher = RabbitMQPublisher(
+                host=os.getenv('RABBITMQ_HOST'),
+                credentials=pika.PlainCredentials(os.getenv('RABBITMQ_USER'), os.getenv('RABBITMQ_PASSWORD')),
+                confirms=os.getenv('RABBITMQ_PUBLISH_CONFIRMS', 'true').lower() == 'true',
+                heartbeat=int(os.getenv('RABBITMQ_HEARTBEAT', 60))
+            )
+            atexit.register(_publisher.close)
+        return _publisher
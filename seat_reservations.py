@@ -0,0 +1,44 @@
+import metrics
+
+# Seat bookkeeping of Events.Available_Seats.
+#
+# Seats are taken and given back with a single conditional UPDATE, so the
+# check and the change happen atomically on the event row: concurrent
+# consumers can never oversell, and only that one row is locked (for the
+# rest of the caller's transaction, keep it short). Events with
+# Max_Registrations 0 or NULL have no seat limit and are never full.
+# Both functions work on the caller's cursor and leave the commit to it.
+
+
+# Function to take a seat of an event, returns False when the event is full
+def reserve_seat(cursor, event_id):
+    cursor.execute("""
+        UPDATE Events
+        SET Available_Seats = IF(Max_Registrations > 0, Available_Seats - 1, Available_Seats)
+        WHERE Id = %s AND (Max_Registrations IS NULL OR Max_Registrations <= 0 OR Available_Seats > 0)
+    """, (event_id,))
+    if cursor.rowcount != 1:
+        # Nothing changed: the event is full, has no seat limit (the row matched but kept its value) or doesn't exist
+        cursor.execute("SELECT Max_Registrations FROM Events WHERE Id = %s", (event_id,))
+        row = cursor.fetchone()
+        if row is None:
+            raise LookupError(f"Event {event_id} not found")
+        if row[0] is not None and row[0] > 0:
+            metrics.increment('seats.rejected')
+            return False
+
+    metrics.increment('seats.reserved')
+    return True
+
+
+# Function to give a seat of an event back, never above Max_Registrations
+def release_seat(cursor, event_id):
+    cursor.execute("""
+        UPDATE Events
+        SET Available_Seats = Available_Seats + 1
+        WHERE Id = %s AND Max_Registrations > 0 AND Available_Seats < Max_Registrations
+    """, (event_id,))
+    released = cursor.rowcount == 1
+    if released:
+        metrics.increment('seats.released')
+    return released
@@ -0,0 +1,41 @@
+import pytest
+import adaptive_poller
+
+
+@pytest.fixture
+def no_jitter(monkeypatch):
+    monkeypatch.setattr(adaptive_poller.random, 'uniform', lambda low, high: 1.0)
+
+
+def test_backs_off_without_changes_up_to_max(no_jitter):
+    poller = adaptive_poller.AdaptivePoller(min_interval=1, max_interval=5, backoff_factor=2)
+    assert [poller.next_delay() for _ in range(4)] == [2, 4, 5, 5]
+
+
+def test_changes_reset_to_min_interval(no_jitter):
+    poller = adaptive_poller.AdaptivePoller(min_interval=1, max_interval=60)
+    poller.next_delay()
+    poller.next_delay()
+    assert poller.next_delay(changes=3) == 1
+
+
+def test_throttled_poll_backs_off_even_with_changes(no_jitter):
+    poller = adaptive_poller.AdaptivePoller(min_interval=1, max_interval=60)
+    assert poller.next_delay(changes=3, throttled=True) == 2
+
+
+def test_retry_after_is_honoured(no_jitter):
+    poller = adaptive_poller.AdaptivePoller(min_interval=1, max_interval=60)
+    assert poller.next_delay(throttled=True, retry_after=30) == 30
+
+
+def test_jitter_never_goes_below_retry_after(monkeypatch):
+    monkeypatch.setattr(adaptive_poller.random, 'uniform', lambda low, high: low)
+    poller = adaptive_poller.AdaptivePoller(min_interval=10, max_interval=10, jitter=0.5)
+    assert poller.next_delay(throttled=True, retry_after=8) == 8
+
+
+def test_jitter_stays_within_bounds():
+    poller = adaptive_poller.AdaptivePoller(min_interval=10, max_interval=10, jitter=0.1)
+    for _ in range(100):
+        assert 9 <= poller.next_delay() <= 11
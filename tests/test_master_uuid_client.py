@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip('dotenv')
+pytest.importorskip('requests')
+
+import master_uuid_client
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(master_uuid_client.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_get_returns_cached_service_id(clock):
+    cache = master_uuid_client.ServiceIdCache(max_size=10, ttl=60)
+    cache.put('master-1', 'planning', 42)
+    assert cache.get('master-1', 'planning') == 42
+    assert cache.get('master-1', 'crm') is None
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = master_uuid_client.ServiceIdCache(max_size=10, ttl=60)
+    cache.put('master-1', 'planning', 42)
+    clock[0] = 59
+    assert cache.get('master-1', 'planning') == 42
+    clock[0] = 60
+    assert cache.get('master-1', 'planning') is None
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = master_uuid_client.ServiceIdCache(max_size=2, ttl=60)
+    cache.put('master-1', 'planning', 1)
+    cache.put('master-2', 'planning', 2)
+    # Reading master-1 makes master-2 the least recently used entry
+    cache.get('master-1', 'planning')
+    cache.put('master-3', 'planning', 3)
+    assert cache.get('master-2', 'planning') is None
+    assert cache.get('master-1', 'planning') == 1
+    assert cache.get('master-3', 'planning') == 3
+
+
+def test_invalidate_removes_entry(clock):
+    cache = master_uuid_client.ServiceIdCache(max_size=10, ttl=60)
+    cache.put('master-1', 'planning', 42)
+    cache.invalidate('master-1', 'planning')
+    assert cache.get('master-1', 'planning') is None
@@ -0,0 +1,50 @@
+import pytest
+import token_bucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(token_bucket.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(token_bucket.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_burst_up_to_capacity_does_not_wait(clock):
+    bucket = token_bucket.TokenBucket(rate=2, capacity=3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert clock.now == 0.0
+
+
+def test_waits_for_the_next_token_when_empty(clock):
+    bucket = token_bucket.TokenBucket(rate=2, capacity=1)
+    bucket.acquire()
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert clock.now == pytest.approx(0.5)
+
+
+def test_steady_stream_is_smoothed_to_rate(clock):
+    bucket = token_bucket.TokenBucket(rate=4, capacity=1)
+    for _ in range(9):
+        bucket.acquire()
+    # The first call uses the initial token, the other 8 wait 1/4 s each
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_refill_never_exceeds_capacity(clock):
+    bucket = token_bucket.TokenBucket(rate=10, capacity=2)
+    bucket.acquire()
+    clock.now += 60
+    assert [bucket.acquire() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(0.1)
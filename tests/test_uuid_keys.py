@@ -0,0 +1,51 @@
+import uuid
+import pytest
+
+pytest.importorskip('dotenv')
+
+import uuid_keys
+
+USER_ID = '3f2b8c1e-9d4a-4e5f-8a7b-6c5d4e3f2a1b'
+
+
+@pytest.fixture
+def binary(monkeypatch):
+    monkeypatch.setattr(uuid_keys, 'BINARY_UUIDS', True)
+
+
+def test_binary_round_trip(binary):
+    stored = uuid_keys.to_db(USER_ID)
+    assert stored == uuid.UUID(USER_ID).bytes
+    assert uuid_keys.from_db(stored) == USER_ID
+    # MySQL returns BINARY(16) columns as a bytearray
+    assert uuid_keys.from_db(bytearray(stored)) == USER_ID
+
+
+def test_binary_stored_value_is_passed_through(binary):
+    stored = uuid.UUID(USER_ID).bytes
+    assert uuid_keys.to_db(stored) is stored
+
+
+def test_varchar_keeps_the_text(monkeypatch):
+    monkeypatch.setattr(uuid_keys, 'BINARY_UUIDS', False)
+    assert uuid_keys.to_db(USER_ID) == USER_ID
+    assert uuid_keys.from_db(USER_ID) == USER_ID
+
+
+@pytest.mark.parametrize('binary_uuids', [False, True])
+@pytest.mark.parametrize('value', [None, '', '   '])
+def test_missing_keys_are_null(monkeypatch, binary_uuids, value):
+    monkeypatch.setattr(uuid_keys, 'BINARY_UUIDS', binary_uuids)
+    assert uuid_keys.to_db(value) is None
+
+
+def test_malformed_key_is_rejected(binary):
+    with pytest.raises(ValueError, match='not-a-uuid'):
+        uuid_keys.to_db('not-a-uuid')
+
+
+def test_column_type(monkeypatch):
+    monkeypatch.setattr(uuid_keys, 'BINARY_UUIDS', True)
+    assert uuid_keys.column_type() == 'BINARY(16)'
+    monkeypatch.setattr(uuid_keys, 'BINARY_UUIDS', False)
+    assert uuid_keys.column_type() == 'VARCHAR(255)'
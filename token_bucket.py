@@ -0,0 +1,34 @@
+import threading
+import time
+
+
+class TokenBucket:
+    # Client-side rate limiter: holds up to capacity tokens and gains rate
+    # tokens per second. Every call takes one token and waits until one is
+    # available, so bursts up to capacity go straight through and a steady
+    # stream is smoothed to rate calls per second.
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    # Function to take a token, returns the number of seconds spent waiting for it
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
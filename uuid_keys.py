@@ -0,0 +1,43 @@
+import os
+import uuid
+import logging
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Storage format of the UUID key columns (User.UserId, User.CompanyId, Company.CompanyId, ...).
+# 'varchar' keeps the UUID text, 'binary' stores the 16 raw bytes in a BINARY(16) column.
+# Switch to 'binary' only together with the binary UUID migration in migrations.py.
+BINARY_UUIDS = os.getenv('UUID_STORAGE', 'varchar').lower() == 'binary'
+
+
+# Function to get the column type to use for a UUID key in new tables
+def column_type():
+    return 'BINARY(16)' if BINARY_UUIDS else 'VARCHAR(255)'
+
+
+# Function to convert a UUID string into the value stored in the database.
+# A missing or blank value (e.g. a user without a company) is stored as NULL.
+# With binary storage anything else that is not a UUID raises ValueError.
+def to_db(value):
+    if value is None or isinstance(value, (bytes, bytearray)):
+        return value
+    if not str(value).strip():
+        return None
+    if not BINARY_UUIDS:
+        return value
+    try:
+        return uuid.UUID(str(value).strip()).bytes
+    except ValueError:
+        logger.error(f"Malformed UUID key: {value!r}")
+        raise ValueError(f"Malformed UUID key: {value!r}") from None
+
+
+# Function to convert a stored UUID key back into its string form
+def from_db(value):
+    if isinstance(value, (bytes, bytearray)) and len(value) == 16:
+        return str(uuid.UUID(bytes=bytes(value)))
+    return value